@@ -4,9 +4,29 @@ The Streamlit client for our interaction
 import streamlit as st
 
 # Custom Imports
-from src.rag import get_summary_results
 from src.indexing.document_loader import YouTubeTranscriptsLoader
 
+# How often the progress of a running job is refreshed, in seconds
+PROGRESS_REFRESH_SECONDS = 0.5
+
+
+#
+# Shared resources
+#
+@st.cache_resource
+def get_job_manager():
+    """
+    The backend (vector store, LLM clients, chain) and the job manager running it
+    are created once per server process, and shared by every session.
+    """
+    from src.summary_jobs import SummaryJobManager
+    from src.indexing.vectorstore import get_vector_store
+
+    # Warm up the vector store, so the first request doesn't pay for it
+    get_vector_store()
+    return SummaryJobManager()
+
+
 #
 # Utility function
 #
@@ -24,24 +44,46 @@ def invoke_retrieval_chain():
     if not is_valid:
         return st.error("Invalid YouTube video URL. Cannot proceed, please check it")
 
-    # Call the backend chain
-    success, response = get_summary_results({
-        "query": query,
-        "video_url": video_url
-    })
+    # Start the backend chain in the background (or get its cached result)
+    st.session_state.job = get_job_manager().submit(video_url, query)
+
 
+def collect_job_result(job):
     # Set session state accordingly
+    success, response = job.result()
     if success:
         st.session_state.model_output = response
         if st.session_state.get('model_error'): del st.session_state['model_error']
     else:
         st.session_state.model_error = response
         if st.session_state.get('model_output'): del st.session_state['model_output']
+    del st.session_state['job']
+
+
+@st.fragment(run_every=PROGRESS_REFRESH_SECONDS)
+def show_job_progress():
+    job = st.session_state.get("job")
+    if job is None:
+        return
+
+    # Once done, rerun the whole script to show the result
+    if job.done():
+        collect_job_result(job)
+        st.rerun()
+
+    with st.status(f"Working on it... ({job.elapsed:.0f}s)", expanded=True):
+        for stage, milliseconds in list(job.stages):
+            st.write(f"✓ {stage.replace('_', ' ')} ({milliseconds:,.0f} ms)")
+
 
 #
 # UI Elements
 #
 
+# Collect the results of jobs done between two runs (e.g. served from the cache)
+if "job" in st.session_state and st.session_state.job.done():
+    collect_job_result(st.session_state.job)
+
 # Input for video URL
 st.text_input(
     label="Video URL",
@@ -61,9 +103,13 @@ st.button(
     label="Let's summarize",
     key="generate_button",
     on_click=invoke_retrieval_chain,
-    disabled=not bool(st.session_state.video_url),
+    disabled=not bool(st.session_state.video_url) or "job" in st.session_state,
 )
 
+# Progress of the running job
+if "job" in st.session_state:
+    show_job_progress()
+
 # Error Display
 if "model_error" in st.session_state:
     st.error("### Error while generating response")
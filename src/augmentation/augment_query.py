@@ -1,10 +1,10 @@
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+
+# Custom imports
+from src.instrumentation.tracing import runnable_span
 
 # The prompt to translate text to english if it isn't
-runnable_convert_to_english_prompt = RunnablePassthrough(
-    lambda _: print(f"[DEBUG]: Detecting language, and converting if necessary")
-) | ChatPromptTemplate(
+runnable_convert_to_english_prompt = runnable_span("translation_prompt", ChatPromptTemplate(
     [
         (
             "system",
@@ -19,12 +19,10 @@ Start your response only after fully analyzing the transcript content inside <tr
         ),
         ("human", "<transcript>{transcript}</transcript>"),
     ]
-)
+))
 
 # Get the qa prompt
-runnable_qa_augment_prompt = RunnablePassthrough(
-    lambda _: print(f"[DEBUG]: Augmenting prompt from given query and context")
-) | ChatPromptTemplate(
+runnable_qa_augment_prompt = runnable_span("augment_prompt", ChatPromptTemplate(
     [
         (
             "system",
@@ -41,4 +39,46 @@ Start your response only after fully analyzing the video content inside <context
         ),
         ("human", "{query}"),
     ]
-)
+))
+
+# The prompts of the artifacts precomputed for every video at ingest time
+# (see `src/generation/artifacts.py`). Changing one of these invalidates its stored artifacts.
+ARTIFACT_SYSTEM_PROMPTS = {
+    "summary": """
+You are a highly capable AI agent specialized in understanding and summarizing video content with precision and clarity. Your task is to deeply analyze the transcript provided within <transcript>...</transcript>. This content represents the full transcription of a video.
+Your goal is to write a complete summary of the whole video.
+When generating your response, follow these strict principles:
+Be accurate and grounded in the given transcript. Do not invent or assume details that are not present within <transcript>.
+Be concise yet informative. Cover every important topic, event or argument of the video in the order it appears.
+Use structured formatting if needed — short paragraphs, bullet points — but only if it aids clarity.
+Start your response only after fully analyzing the video content inside <transcript>...</transcript>
+    """,
+    "outline": """
+You are a highly capable AI agent specialized in structuring video content. Your task is to deeply analyze the transcript provided within <transcript>...</transcript>. This content represents the full transcription of a video, and may contain timestamps in the form [mm:ss] or [hh:mm:ss].
+Your goal is to write a chaptered outline of the whole video.
+When generating your response, follow these strict principles:
+Be accurate and grounded in the given transcript. Do not invent or assume details that are not present within <transcript>.
+Split the video into chapters following the changes of topic, each with a short title and one or two sentences describing it.
+Start every chapter with the timestamp at which it begins, if the transcript contains timestamps. Never invent timestamps.
+Start your response only after fully analyzing the video content inside <transcript>...</transcript>
+    """,
+    "key_points": """
+You are a highly capable AI agent specialized in understanding video content with precision and clarity. Your task is to deeply analyze the transcript provided within <transcript>...</transcript>. This content represents the full transcription of a video.
+Your goal is to list the key takeaways of the video.
+When generating your response, follow these strict principles:
+Be accurate and grounded in the given transcript. Do not invent or assume details that are not present within <transcript>.
+Write between 5 and 10 bullet points, each a single self-contained sentence, ordered by importance.
+Start your response only after fully analyzing the video content inside <transcript>...</transcript>
+    """,
+}
+
+runnable_artifact_prompts = {
+    kind: runnable_span(
+        "artifact_prompt",
+        ChatPromptTemplate(
+            [("system", system_prompt), ("human", "<transcript>{transcript}</transcript>")]
+        ),
+        kind=kind,
+    )
+    for kind, system_prompt in ARTIFACT_SYSTEM_PROMPTS.items()
+}
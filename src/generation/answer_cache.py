@@ -0,0 +1,235 @@
+"""
+Semantic answer cache
+
+Paraphrases of the same question about the same video ("summarize", "give me a
+summary", "tl;dr") retrieve the same chunks and get the same answer. This cache
+keeps, per video, the (query embedding, retrieved chunk IDs, answer) of previous
+requests, and serves the cached answer when a new query is similar enough and
+retrieved exactly the same chunks.
+
+Every video keeps its query embeddings in a single normalized float32 matrix, so a
+lookup is one matrix-vector product. Entries are evicted least recently used, both
+within a video and across videos.
+
+Configuration (environment):
+- SEMANTIC_CACHE_ENABLED: set to "0" to disable the cache
+- SEMANTIC_CACHE_THRESHOLD: the minimum cosine similarity of a hit (default 0.92)
+- SEMANTIC_CACHE_MAX_ENTRIES: the answers kept per video (default 256)
+- SEMANTIC_CACHE_MAX_VIDEOS: the videos kept in the cache (default 1024)
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TypedDict
+
+import numpy as np
+
+# Langchain imports
+from langchain_core.runnables import RunnableLambda
+from langchain.schema import Document
+
+# Custom imports
+from src.instrumentation.tracing import record_cache, traced
+
+# CONFIGURATION for the cache
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") != "0"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "256"))
+SEMANTIC_CACHE_MAX_VIDEOS = int(os.getenv("SEMANTIC_CACHE_MAX_VIDEOS", "1024"))
+
+
+class _VideoAnswers:
+    """The cached answers of a single video"""
+
+    def __init__(self, dimensions: int, max_entries: int):
+        self.embeddings = np.zeros((min(8, max_entries), dimensions), dtype=np.float32)
+        self.last_used = np.zeros(len(self.embeddings), dtype=np.int64)
+        self.chunk_keys: list[frozenset[str]] = []
+        self.answers: list[str] = []
+        self.max_entries = max_entries
+
+    def lookup(self, query: np.ndarray, chunk_key: frozenset[str], threshold: float, clock: int) -> str | None:
+        size = len(self.answers)
+        if size == 0:
+            return None
+        similarities = self.embeddings[:size] @ query
+        # Best match first, among those above the threshold
+        candidates = np.flatnonzero(similarities >= threshold)
+        for index in candidates[np.argsort(-similarities[candidates])]:
+            if self.chunk_keys[index] == chunk_key:
+                self.last_used[index] = clock
+                return self.answers[index]
+        return None
+
+    def store(self, query: np.ndarray, chunk_key: frozenset[str], answer: str, clock: int) -> None:
+        size = len(self.answers)
+        if size < self.max_entries:
+            # Grow the matrix geometrically
+            if size == len(self.embeddings):
+                capacity = min(self.max_entries, 2 * size)
+                self.embeddings = np.resize(self.embeddings, (capacity, self.embeddings.shape[1]))
+                self.last_used = np.resize(self.last_used, capacity)
+            index = size
+            self.chunk_keys.append(chunk_key)
+            self.answers.append(answer)
+        else:
+            # Replace the least recently used entry
+            index = int(np.argmin(self.last_used[:size]))
+            self.chunk_keys[index] = chunk_key
+            self.answers[index] = answer
+
+        self.embeddings[index] = query
+        self.last_used[index] = clock
+
+
+class SemanticAnswerCache:
+    """
+    A per video cache of answers, keyed by query embedding similarity and the exact
+    set of retrieved chunks.
+
+    Example:
+        >>> cache = SemanticAnswerCache(threshold=0.92)
+        >>> cache.store("dQw4w9WgXcQ", embedding, ["id-1", "id-2"], "The video is about...")
+        >>> cache.lookup("dQw4w9WgXcQ", paraphrase_embedding, ["id-1", "id-2"])
+        'The video is about...'
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries_per_video: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        max_videos: int = SEMANTIC_CACHE_MAX_VIDEOS,
+    ):
+        self.threshold = threshold
+        self.max_entries_per_video = max_entries_per_video
+        self.max_videos = max_videos
+        self._videos: OrderedDict[str, _VideoAnswers] = OrderedDict()
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def __normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, video_id: str, query_embedding: list[float], chunk_ids: list[str]) -> str | None:
+        """
+        Args:
+            video_id: The video the query is about
+            query_embedding: The embedding of the query
+            chunk_ids: The IDs of the chunks retrieved for the query
+
+        Returns:
+            str | None: The cached answer, if any
+        """
+        query = self.__normalize(query_embedding)
+        with self._lock:
+            video = self._videos.get(video_id)
+            if video is None or video.embeddings.shape[1] != len(query):
+                return None
+            self._clock += 1
+            self._videos.move_to_end(video_id)
+            return video.lookup(query, frozenset(chunk_ids), self.threshold, self._clock)
+
+    def store(self, video_id: str, query_embedding: list[float], chunk_ids: list[str], answer: str) -> None:
+        """
+        Args:
+            video_id: The video the query is about
+            query_embedding: The embedding of the query
+            chunk_ids: The IDs of the chunks retrieved for the query
+            answer: The generated answer
+        """
+        query = self.__normalize(query_embedding)
+        with self._lock:
+            video = self._videos.get(video_id)
+            # A new video, or the embedding model changed
+            if video is None or video.embeddings.shape[1] != len(query):
+                video = self._videos[video_id] = _VideoAnswers(len(query), self.max_entries_per_video)
+                if len(self._videos) > self.max_videos:
+                    self._videos.popitem(last=False)
+            self._clock += 1
+            self._videos.move_to_end(video_id)
+            video.store(query, frozenset(chunk_ids), answer, self._clock)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._videos.clear()
+
+
+# The cache shared by every request of this process
+answer_cache = SemanticAnswerCache()
+
+
+def get_chunk_ids(chunks: list[Document]) -> list[str]:
+    """The store IDs of the chunks, or a hash of their content if they have none"""
+    return [
+        chunk.id or hashlib.sha1(chunk.page_content.encode("utf-8")).hexdigest()
+        for chunk in chunks
+    ]
+
+
+"""
+The Runnables looking up and storing answers
+"""
+
+
+class LookupAnswerInputs(TypedDict):
+    query: str
+    video_id: str
+    query_embedding: list[float]
+    chunks: list[Document]
+
+
+class LookupAnswerOutputs(TypedDict):
+    query: str
+    video_id: str
+    query_embedding: list[float]
+    chunks: list[Document]
+    cached_answer: str | None
+
+
+@traced("answer_cache_lookup")
+def __lookup_answer(inputs: LookupAnswerInputs) -> LookupAnswerOutputs:
+    """
+    Looks up a cached answer for the query and its retrieved chunks
+    Args:
+        inputs: { query: str, video_id: str, query_embedding: list[float], chunks: list[Document] }
+    Returns:
+        outputs: { ..., cached_answer: str | None }
+    """
+    inputs["cached_answer"] = None
+    if SEMANTIC_CACHE_ENABLED and inputs.get("query_embedding") is not None:
+        inputs["cached_answer"] = answer_cache.lookup(
+            inputs["video_id"], inputs["query_embedding"], get_chunk_ids(inputs["chunks"])
+        )
+        record_cache("answers", hit=inputs["cached_answer"] is not None)
+    return inputs
+
+
+class StoreAnswerInputs(LookupAnswerInputs):
+    answer: str
+
+
+def __store_answer(inputs: StoreAnswerInputs) -> str:
+    """
+    Stores the generated answer in the cache
+    Args:
+        inputs: { query: str, video_id: str, query_embedding: list[float], chunks: list[Document], answer: str }
+    Returns:
+        answer: str
+    """
+    if SEMANTIC_CACHE_ENABLED and inputs.get("query_embedding") is not None:
+        answer_cache.store(
+            inputs["video_id"],
+            inputs["query_embedding"],
+            get_chunk_ids(inputs["chunks"]),
+            inputs["answer"],
+        )
+    return inputs["answer"]
+
+
+runnable_lookup_answer = RunnableLambda(__lookup_answer)
+runnable_store_answer = RunnableLambda(__store_answer)
@@ -0,0 +1,298 @@
+"""
+Precomputed per-video artifacts
+
+Most requests ask for the same few things about a video: an overall summary (the
+default, empty query of the web UI), a chaptered outline or its key takeaways. When
+enabled, the ingestion of a video enqueues the background generation of these
+artifacts from the full transcript, and the pipeline serves them directly when the
+query asks for one of them, without retrieval nor generation.
+
+Artifacts are stored next to the vector store, in `<PERSIST_DIRECTORY>/artifacts.sqlite3`,
+and versioned by model and prompt: changing either regenerates them on the next ingest,
+and stale versions are never served. An artifact written by a fallback model (after a
+failover of the router) is stored under that model's version, so it isn't served as
+the preferred model's, and is generated again on the next ingest.
+
+Configuration (environment):
+- PRECOMPUTE_ARTIFACTS: set to "1" to generate the artifacts at ingest time
+- ARTIFACT_WORKERS: the number of background generation threads (default 1)
+- ARTIFACT_MAX_CHARS: transcripts are truncated to this length for generation (default 400000)
+"""
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TypedDict
+
+# Langchain imports
+from langchain_core.runnables import RunnableLambda
+
+# Custom imports
+import src.indexing.vectorstore as vectorstore
+from src.augmentation.augment_query import ARTIFACT_SYSTEM_PROMPTS, runnable_artifact_prompts
+from src.generation.llm import model_config, model_configs, runnable_generate
+from src.generation.router import track_providers
+from src.instrumentation.tracing import logger, record_cache, span, traced
+
+# CONFIGURATION for the artifacts
+PRECOMPUTE_ARTIFACTS = os.getenv("PRECOMPUTE_ARTIFACTS", "0") == "1"
+ARTIFACT_WORKERS = int(os.getenv("ARTIFACT_WORKERS", "1"))
+ARTIFACT_MAX_CHARS = int(os.getenv("ARTIFACT_MAX_CHARS", "400000"))
+ARTIFACT_KINDS = tuple(ARTIFACT_SYSTEM_PROMPTS)
+
+# Markers are inserted in the transcript at most this often, for the outline
+TIMESTAMP_EVERY_SECONDS = 30
+
+
+def get_artifact_version(kind: str, model: str | None = None) -> str:
+    """
+    The version of an artifact: the model generating it, and the hash of its prompt
+
+    Args:
+        kind: The artifact kind
+        model: The model which wrote it, the preferred one by default
+    """
+    prompt_hash = hashlib.sha256(ARTIFACT_SYSTEM_PROMPTS[kind].encode("utf-8")).hexdigest()
+    return f"{model or model_config['model']}@{prompt_hash[:12]}"
+
+
+def __get_answering_model(providers: list[str]) -> str:
+    # The model of the last provider which answered, the preferred one if the `llm`
+    # doesn't report it (e.g. it isn't a router)
+    if not providers:
+        return model_config["model"]
+    models = {config["model_provider"]: config["model"] for config in model_configs}
+    return models.get(providers[-1], providers[-1])
+
+
+class ArtifactStore:
+    """
+    The artifacts of every video, in a SQLite database next to the vector store
+
+    Example:
+        >>> store = ArtifactStore()
+        >>> store.put("dQw4w9WgXcQ", "summary", get_artifact_version("summary"), "The video...")
+        >>> store.get("dQw4w9WgXcQ", "summary", get_artifact_version("summary"))
+        'The video...'
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._local = threading.local()
+
+    def __path(self) -> str:
+        return self.path or os.path.join(vectorstore.PERSIST_DIRECTORY, "artifacts.sqlite3")
+
+    def __connection(self) -> sqlite3.Connection:
+        path = self.__path()
+        # One connection per thread (and per path, the benchmarks move the store around)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.path != path:
+            connection = sqlite3.connect(path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                " video_id TEXT NOT NULL, kind TEXT NOT NULL, version TEXT NOT NULL,"
+                " content TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (video_id, kind, version))"
+            )
+            self._local.connection, self._local.path = connection, path
+        return connection
+
+    def get(self, video_id: str, kind: str, version: str) -> str | None:
+        # Reading doesn't create the database
+        if not os.path.isfile(self.__path()):
+            return None
+        row = self.__connection().execute(
+            "SELECT content FROM artifacts WHERE video_id = ? AND kind = ? AND version = ?",
+            (video_id, kind, version),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, video_id: str, kind: str, version: str, content: str) -> None:
+        with self.__connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                (video_id, kind, version, content, time.time()),
+            )
+
+
+# The store shared by the whole process
+artifact_store = ArtifactStore()
+
+
+def format_timestamped_transcript(
+    transcript: str, timestamps: list[tuple[int, float]] | None
+) -> str:
+    """
+    Inserts `[mm:ss]` markers in the transcript, so the outline can refer to them
+
+    Args:
+        transcript: The full transcript
+        timestamps: (character offset, start in seconds) of every transcript segment
+
+    Returns:
+        str: The transcript with a marker every `TIMESTAMP_EVERY_SECONDS` at most
+    """
+    if not timestamps:
+        return transcript
+
+    parts, previous_offset, next_marker = [], 0, 0.0
+    for offset, start in timestamps:
+        if start < next_marker:
+            continue
+        parts.append(transcript[previous_offset:offset])
+        minutes, seconds = divmod(int(start), 60)
+        hours, minutes = divmod(minutes, 60)
+        parts.append(f"[{hours}:{minutes:02d}:{seconds:02d}] " if hours else f"[{minutes:02d}:{seconds:02d}] ")
+        previous_offset, next_marker = offset, start + TIMESTAMP_EVERY_SECONDS
+    parts.append(transcript[previous_offset:])
+    return "".join(parts)
+
+
+def generate_artifacts(
+    video_id: str, transcript: str, timestamps: list[tuple[int, float]] | None = None
+) -> None:
+    """
+    Generates and stores every missing artifact of a video
+
+    Args:
+        video_id: The video
+        transcript: Its full transcript
+        timestamps: (character offset, start in seconds) of every transcript segment, if known
+    """
+    timestamped_transcript = format_timestamped_transcript(transcript, timestamps)
+    for kind in ARTIFACT_KINDS:
+        version = get_artifact_version(kind)
+        if artifact_store.get(video_id, kind, version) is not None:
+            continue
+
+        text = timestamped_transcript if kind == "outline" else transcript
+        try:
+            with span("artifact_generate", video_id=video_id, kind=kind) as attributes, \
+                    track_providers() as providers:
+                content = (runnable_artifact_prompts[kind] | runnable_generate).invoke(
+                    {"transcript": text[:ARTIFACT_MAX_CHARS]}
+                )
+                attributes["model"] = model = __get_answering_model(providers)
+            artifact_store.put(video_id, kind, get_artifact_version(kind, model), content)
+        except Exception:
+            logger.exception("Couldn't generate the %s of video '%s'", kind, video_id)
+
+
+_executor: ThreadPoolExecutor | None = None
+_pending: dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+
+def enqueue_artifacts(
+    video_id: str, transcript: str, timestamps: list[tuple[int, float]] | None = None
+) -> Future | None:
+    """
+    Generates the artifacts of a video in the background, if enabled. A video
+    already in the queue isn't enqueued twice.
+
+    Returns:
+        Future | None: The background job, None if `PRECOMPUTE_ARTIFACTS` is disabled
+    """
+    global _executor
+    if not PRECOMPUTE_ARTIFACTS:
+        return None
+
+    with _pending_lock:
+        if video_id in _pending:
+            return _pending[video_id]
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=ARTIFACT_WORKERS, thread_name_prefix="artifacts"
+            )
+        future = _pending[video_id] = _executor.submit(
+            generate_artifacts, video_id, transcript, timestamps
+        )
+
+    def _done(_):
+        with _pending_lock:
+            _pending.pop(video_id, None)
+
+    future.add_done_callback(_done)
+    return future
+
+
+# Words that don't change which artifact a query asks for
+_FILLER_WORDS = {
+    "please", "pls", "the", "this", "that", "video", "videos", "of", "me", "give",
+    "a", "an", "can", "could", "you", "i", "want", "show", "write", "list", "its",
+    "it", "s", "provide", "create", "make", "for", "full", "overall", "quick", "short",
+}
+
+_ARTIFACT_QUERIES = {
+    "summary": {
+        "", "summary", "summarize", "summarise", "tldr", "tl dr",
+        "overview", "what is about", "whats about", "what about", "gist",
+    },
+    "outline": {
+        "outline", "chapters", "chapter outline", "chaptered outline", "timestamps",
+        "outline with timestamps", "chapters with timestamps", "table contents",
+    },
+    "key_points": {
+        "key points", "key takeaways", "takeaways", "main points", "highlights",
+        "key insights", "main takeaways",
+    },
+}
+
+
+def match_artifact_kind(query: str | None) -> str | None:
+    """
+    Returns the kind of artifact the query asks for, e.g. "summary" for an empty
+    query or "tl;dr", or None if the query is anything more specific
+    """
+    words = re.findall(r"[a-z]+", (query or "").lower())
+    normalized = " ".join(word for word in words if word not in _FILLER_WORDS)
+    for kind, queries in _ARTIFACT_QUERIES.items():
+        if normalized in queries:
+            return kind
+    return None
+
+
+"""
+The Runnable serving the artifacts
+"""
+
+
+class LookupArtifactInputs(TypedDict):
+    query: str
+    video_id: str
+
+
+class LookupArtifactOutputs(TypedDict):
+    query: str
+    video_id: str
+    artifact: str | None
+
+
+@traced("artifact_lookup")
+def __lookup_artifact(inputs: LookupArtifactInputs) -> LookupArtifactOutputs:
+    """
+    Looks up the precomputed artifact matching the query, if any (and if enabled)
+    Args:
+        inputs: { query: str, video_id: str }
+    Returns:
+        outputs: { query: str, video_id: str, artifact: str | None }
+    """
+    inputs["artifact"] = None
+    if not PRECOMPUTE_ARTIFACTS:
+        return inputs
+    kind = match_artifact_kind(inputs.get("query"))
+    if kind is not None:
+        inputs["artifact"] = artifact_store.get(
+            inputs["video_id"], kind, get_artifact_version(kind)
+        )
+        record_cache("artifacts", hit=inputs["artifact"] is not None)
+    return inputs
+
+
+runnable_lookup_artifact = RunnableLambda(__lookup_artifact)
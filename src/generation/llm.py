@@ -1,9 +1,13 @@
 import os
 from langchain.chat_models import init_chat_model
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableLambda
 from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
 
+# Custom imports
+from src.generation.router import ProviderRouter, ResilientProvider
+from src.instrumentation.tracing import runnable_span, usage_callback_handler
+
 
 # This is a function to clean <think>...</think> content from the response 
 # If we choose to opt for a reasoning model
@@ -37,69 +41,108 @@ if HUGGINGFACEHUB_API_TOKEN:
     from huggingface_hub import login
     login(HUGGINGFACEHUB_API_TOKEN)
 
-def get_model_config():
+def get_model_configs() -> list[dict]:
+    """
+    Returns the configuration of every LLM provider we have credentials for, in order
+    of preference. The order can be overridden with `LLM_PROVIDERS`, a comma separated
+    list of `google_genai`, `huggingface` and `openai`.
+
+    Raises:
+        EnvironmentError: If no provider is configured
+    """
+    model_configs = []
     # The precedence goes like
     # Gemini,
     if GOOGLE_API_KEY:
-        return dict(
+        model_configs.append(dict(
             model=os.getenv("GOOGLE_GENERATIVE_MODEL", "gemini-2.5-flash"),
             model_provider="google_genai",
-        )
+            env_prefix="GOOGLE",
+        ))
 
     # Huggingface
     if HUGGINGFACEHUB_API_TOKEN:
-        return dict(
+        model_configs.append(dict(
             model=os.getenv("HUGGINGFACE_MODEL", "deepseek-ai/DeepSeek-R1-0528"),
             model_provider="huggingface",
-            huggingfacehub_api_token=HUGGINGFACEHUB_API_TOKEN
-        )
+            huggingfacehub_api_token=HUGGINGFACEHUB_API_TOKEN,
+            env_prefix="HUGGINGFACE",
+        ))
 
     # OpenAI
     if OPENAI_API_KEY:
-        return dict(
-            model=os.getenv("OPENAI_MODEL", "gpt-4.1-mini"), model_provider="openai"
+        model_configs.append(dict(
+            model=os.getenv("OPENAI_MODEL", "gpt-4.1-mini"),
+            model_provider="openai",
+            env_prefix="OPENAI",
+        ))
+
+    # Explicit order (and selection) of the providers
+    if os.getenv("LLM_PROVIDERS"):
+        order = [name.strip() for name in os.environ["LLM_PROVIDERS"].split(",")]
+        model_configs = sorted(
+            (config for config in model_configs if config["model_provider"] in order),
+            key=lambda config: order.index(config["model_provider"]),
         )
 
-    raise EnvironmentError(
-        "None of `GOOGLE_API_KEY`, `HUGGINGFACEHUB_API_TOKEN`, `OPENAI_API_KEY` are set. Set at least one of these for LLM model usage"
-    )
+    if not model_configs:
+        raise EnvironmentError(
+            "None of `GOOGLE_API_KEY`, `HUGGINGFACEHUB_API_TOKEN`, `OPENAI_API_KEY` are set. Set at least one of these for LLM model usage"
+        )
+    return model_configs
 
 
-# Get the model configurations
-model_config = get_model_config()
-
-# Create an llm
-llm = None
-
-if 'huggingfacehub_api_token' in model_config:
-    llm_endpoint = HuggingFaceEndpoint(
-        repo_id=model_config['model'],
-        task="text-generation",
-        do_sample=False,
-        repetition_penalty=1.03,
-        provider="auto",  # let Hugging Face choose the best provider for you
-    )
-    llm = ChatHuggingFace(llm=llm_endpoint)
-else:
-    llm = init_chat_model(
+def get_model_config() -> dict:
+    # The preferred provider
+    return get_model_configs()[0]
+
+
+def create_chat_model(model_config: dict):
+    """
+    Creates the chat model for one of the configurations of `get_model_configs()`
+    """
+    if 'huggingfacehub_api_token' in model_config:
+        llm_endpoint = HuggingFaceEndpoint(
+            repo_id=model_config['model'],
+            task="text-generation",
+            do_sample=False,
+            repetition_penalty=1.03,
+            provider="auto",  # let Hugging Face choose the best provider for you
+        )
+        return ChatHuggingFace(llm=llm_endpoint)
+
+    return init_chat_model(
         model=model_config['model'],
         model_provider=model_config['model_provider'],
         temperature=0.5,
     )
 
 
+# Get the model configurations
+model_configs = get_model_configs()
+model_config = model_configs[0]
+
+# Create an llm, which fails over between the configured providers within their
+# quotas, and records the token usage and cost of every call
+llm = ProviderRouter([
+    (
+        ResilientProvider.from_env(config['model_provider'], config['env_prefix']),
+        create_chat_model(config).with_config(callbacks=[usage_callback_handler]),
+    )
+    for config in model_configs
+])
+
+
+# The model is looked up on every call rather than bound into the chains, so it
+# can be swapped at runtime (e.g. by a local fake in the benchmarks)
+def __invoke_llm(prompt, config):
+    return llm.invoke(prompt, config)
+
+
+runnable_llm = RunnableLambda(__invoke_llm, name="llm")
+
 # The chain to translate to english if not already
-runnable_generate_translation = (
-    RunnablePassthrough(lambda _: print(f"[DEBUG]: Translating the input to English"))
-    | llm
-    | str_parser
-    | RunnablePassthrough(lambda _: print(f"[DEBUG]: Translation completed"))
-)
+runnable_generate_translation = runnable_span("translate", runnable_llm | str_parser)
 
 # The main exportable here
-runnable_generate = (
-    RunnablePassthrough(lambda _: print(f"[DEBUG]: Generating response for query"))
-    | llm
-    | str_parser
-    | RunnablePassthrough(lambda _: print(f"[DEBUG]: Response generation complete"))
-)
+runnable_generate = runnable_span("generate", runnable_llm | str_parser)
@@ -0,0 +1,414 @@
+"""
+Provider aware rate limiting, retries and failover
+
+Every model provider (LLM or embedding) is wrapped in a `ResilientProvider`, which:
+- waits on client side token buckets for its requests-per-minute and
+  tokens-per-minute quotas, so we saturate the quota without going over it. The
+  prompt is estimated up front, and the bucket is topped up with the real usage
+  (prompt and completion tokens) once the call returns.
+- retries rate limits (429), server errors and timeouts with jittered exponential backoff
+- stops calling a provider which keeps failing (with those errors), through a circuit
+  breaker. Client errors, e.g. a too long input, are raised as they are: they don't
+  say anything about the health of the provider.
+
+`ProviderRouter` then tries the configured LLM providers in order, failing over to
+the next one when a provider is rate limited for too long, its circuit is open or it
+keeps failing. Embeddings only use a single `ResilientProvider` (no failover), since
+every vector of the store must come from the same model.
+
+Configuration (environment), where <PREFIX> is the provider prefix, e.g. `GOOGLE`,
+`HUGGINGFACE`, `OPENAI` or `OPENAI_EMBEDDINGS`:
+- <PREFIX>_RPM / <PREFIX>_TPM: the requests / tokens per minute quota, unset for no limit
+- ROUTER_MAX_RETRIES: retries per provider before failing over (default 3)
+- ROUTER_BACKOFF_SECONDS / ROUTER_MAX_BACKOFF_SECONDS: the backoff base and cap (default 0.5 / 20)
+- ROUTER_MAX_WAIT_SECONDS: the longest wait on a rate limiter before failing over (default 30)
+- CIRCUIT_FAILURE_THRESHOLD: consecutive failures opening the circuit (default 5)
+- CIRCUIT_RESET_SECONDS: how long an open circuit rejects calls (default 30)
+"""
+
+import os
+import re
+import time
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, TypeVar
+
+# Langchain imports
+from langchain_core.runnables import Runnable, RunnableConfig
+
+# Custom imports
+from src.instrumentation.tracing import increment_counter, span
+
+T = TypeVar("T")
+
+# CONFIGURATION for the retries and circuit breakers
+ROUTER_MAX_RETRIES = int(os.getenv("ROUTER_MAX_RETRIES", "3"))
+ROUTER_BACKOFF_SECONDS = float(os.getenv("ROUTER_BACKOFF_SECONDS", "0.5"))
+ROUTER_MAX_BACKOFF_SECONDS = float(os.getenv("ROUTER_MAX_BACKOFF_SECONDS", "20"))
+ROUTER_MAX_WAIT_SECONDS = float(os.getenv("ROUTER_MAX_WAIT_SECONDS", "30"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+
+# The names of the providers which answered the `ProviderRouter` calls, while tracked.
+# A list rather than a value, so it is shared with the contexts LangChain copies.
+_answered_by: ContextVar[list[str] | None] = ContextVar("answered_by", default=None)
+
+
+@contextmanager
+def track_providers() -> Iterator[list[str]]:
+    """
+    Collects the name of the provider answering every `ProviderRouter` call made
+    in the block, e.g. to tell which model actually wrote a result after a failover
+
+    Example:
+        >>> with track_providers() as providers:
+        >>>     answer = llm.invoke(prompt)
+        >>> providers
+        ['openai']
+    """
+    providers: list[str] = []
+    token = _answered_by.set(providers)
+    try:
+        yield providers
+    finally:
+        _answered_by.reset(token)
+
+
+class ProviderUnavailableError(Exception):
+    """Raised when a provider can't be called right now (open circuit or exhausted quota)."""
+    pass
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket. Callers reserve their tokens up front and then sleep
+    until the bucket has refilled, which keeps concurrent callers in order.
+
+    Requests larger than the capacity (the burst) are let through once a full bucket
+    is available, and charged in full: the balance goes negative, and the following
+    callers wait until it is paid back. The average rate never exceeds `rate`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: Tokens added per second
+            capacity: The maximum number of tokens (the allowed burst)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, limit: float, burst_seconds: float = 10.0):
+        """A bucket allowing `limit` per minute, with bursts of up to `burst_seconds` worth"""
+        rate = limit / 60
+        return cls(rate=rate, capacity=max(1.0, rate * burst_seconds))
+
+    @classmethod
+    def from_env(cls, name: str):
+        """The bucket for the per minute quota in the env variable `name`, or None if it isn't set"""
+        limit = os.getenv(name)
+        return cls.per_minute(float(limit)) if limit else None
+
+    def __refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0, max_wait: float | None = None) -> bool:
+        """
+        Takes `tokens` from the bucket, sleeping until they are available
+
+        Args:
+            tokens: The number of tokens to take (all of them are charged, even above the capacity)
+            max_wait: Don't wait longer than this many seconds, None to wait as long as needed
+
+        Returns:
+            bool: False if the tokens wouldn't be available within `max_wait`
+        """
+        with self._lock:
+            self.__refill(time.monotonic())
+            # Wait for (at most) a full bucket, the rest is paid back by the next callers
+            wait = max(0.0, (min(tokens, self.capacity) - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return False
+            self._tokens -= tokens
+
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def charge(self, tokens: float) -> None:
+        """
+        Adjusts the balance without waiting, e.g. with the difference between the real
+        usage of a call and its estimate (negative to give tokens back)
+        """
+        with self._lock:
+            self.__refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens - tokens)
+
+    def pause(self, seconds: float) -> None:
+        """Empties the bucket for `seconds`, e.g. after the provider answered with a 429"""
+        with self._lock:
+            self.__refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, rejecting calls for
+    `reset_seconds`. Then a single trial call is let through (half open), which
+    closes the circuit again on success.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Gives the half open trial back, when it ended before calling the provider"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def __status_code(error: Exception) -> int | None:
+    # The SDKs expose the HTTP status in different places
+    for attribute in ("status_code", "code", "http_status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+# The exceptions of the SDKs for a 429 (openai, anthropic, google.api_core...)
+RATE_LIMIT_ERRORS = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+# The fallback for the errors without a status code, whole words only: a "429" or
+# "quota" within a longer word or number (e.g. "14290 tokens") isn't a rate limit
+RATE_LIMIT_PATTERN = re.compile(
+    r"\b(429|too many requests|rate[ _-]?limit(ed)?|resource[ _]?exhausted|quota)\b", re.IGNORECASE
+)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether the provider rejected the call because of its quota"""
+    status_code = __status_code(error)
+    if status_code is not None:
+        return status_code == 429
+    if type(error).__name__ in RATE_LIMIT_ERRORS:
+        return True
+    return RATE_LIMIT_PATTERN.search(str(error)) is not None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Whether calling the same provider again might succeed (quota, server errors, timeouts)"""
+    if is_rate_limit_error(error):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status_code = __status_code(error)
+    if status_code is not None:
+        return status_code >= 500 or status_code == 408
+    message = f"{type(error).__name__} {error}".lower()
+    return any(
+        marker in message
+        for marker in ("timeout", "timed out", "overloaded", "unavailable", "connection")
+    )
+
+
+class ResilientProvider:
+    """
+    Calls a single provider within its quota, with retries and a circuit breaker
+
+    Example:
+        >>> provider = ResilientProvider("openai", requests_bucket=TokenBucket.per_minute(500))
+        >>> vectors = provider.call(lambda: embeddings.embed_documents(texts), tokens=1200)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_bucket: TokenBucket | None = None,
+        tokens_bucket: TokenBucket | None = None,
+        breaker: CircuitBreaker | None = None,
+        max_retries: int = ROUTER_MAX_RETRIES,
+    ):
+        self.name = name
+        self.requests_bucket = requests_bucket
+        self.tokens_bucket = tokens_bucket
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str):
+        """A provider with the quotas from `<prefix>_RPM` and `<prefix>_TPM`"""
+        return cls(
+            name,
+            requests_bucket=TokenBucket.from_env(f"{prefix}_RPM"),
+            tokens_bucket=TokenBucket.from_env(f"{prefix}_TPM"),
+        )
+
+    def __acquire(self, tokens: int) -> None:
+        for bucket, amount in ((self.requests_bucket, 1), (self.tokens_bucket, tokens)):
+            if bucket is not None and not bucket.acquire(amount, max_wait=ROUTER_MAX_WAIT_SECONDS):
+                increment_counter("yt_router_events_total", provider=self.name, event="throttled")
+                raise ProviderUnavailableError(f"Quota of '{self.name}' exhausted for too long")
+
+    def __backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(ROUTER_MAX_BACKOFF_SECONDS, ROUTER_BACKOFF_SECONDS * 2**attempt))
+
+    def call(
+        self,
+        func: Callable[[], T],
+        tokens: int = 0,
+        used_tokens: Callable[[T], int | None] | None = None,
+    ) -> T:
+        """
+        Calls `func` within the quota of this provider, retrying transient errors
+
+        Args:
+            func: The call to the provider
+            tokens: The (estimated) number of tokens of the call, for the tokens-per-minute quota
+            used_tokens: Gives the real number of tokens of the call from its result (None if
+                unknown), to charge the difference with the estimate
+
+        Returns:
+            The result of `func`
+
+        Raises:
+            ProviderUnavailableError: If the circuit is open or the quota is exhausted for too long
+            Exception: The last error of `func`, if it isn't retryable or retries are exhausted
+        """
+        for attempt in range(self.max_retries + 1):
+            # Don't wait on the quota of an open circuit
+            if self.breaker.state == "open":
+                increment_counter("yt_router_events_total", provider=self.name, event="circuit_open")
+                raise ProviderUnavailableError(f"Circuit of '{self.name}' is open")
+            # The quota first, so a throttled call never holds the half open trial
+            self.__acquire(tokens)
+            if not self.breaker.allow_request():
+                increment_counter("yt_router_events_total", provider=self.name, event="circuit_open")
+                raise ProviderUnavailableError(f"Circuit of '{self.name}' is open")
+
+            try:
+                result = func()
+            except BaseException as e:
+                if not isinstance(e, Exception) or not is_retryable_error(e):
+                    # Interrupted, or rejected because of the input: the provider didn't fail
+                    self.breaker.release_trial()
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+
+                delay = self.__backoff(attempt)
+                if is_rate_limit_error(e):
+                    increment_counter("yt_router_events_total", provider=self.name, event="rate_limited")
+                    # Keep every other caller off this provider for a while too
+                    for bucket in (self.requests_bucket, self.tokens_bucket):
+                        if bucket is not None:
+                            bucket.pause(delay)
+                increment_counter("yt_router_events_total", provider=self.name, event="retry")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                if used_tokens is not None and self.tokens_bucket is not None:
+                    used = used_tokens(result)
+                    if used is not None:
+                        self.tokens_bucket.charge(used - tokens)
+                return result
+
+
+class ProviderRouter(Runnable):
+    """
+    A chat model Runnable trying each of its providers in order, and failing over
+    to the next one when a provider is unavailable or keeps failing.
+    """
+
+    def __init__(self, providers: list[tuple[ResilientProvider, Runnable]]):
+        """
+        Args:
+            providers: (provider, chat model) pairs, in order of preference
+        """
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = providers
+
+    @staticmethod
+    def __used_tokens(result: Any, prompt_tokens: int) -> int:
+        # The prompt and completion tokens reported by the provider, else estimated
+        usage = getattr(result, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            return usage["total_tokens"]
+        return prompt_tokens + len(str(getattr(result, "content", result))) // 4
+
+    def invoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        # Estimate the prompt size for the tokens-per-minute quotas, the real usage
+        # (with the completion) is charged once the call returns
+        text = input.to_string() if hasattr(input, "to_string") else str(input)
+        tokens = len(text) // 4
+
+        last_error: Exception | None = None
+        for provider, model in self.providers:
+            try:
+                with span("llm_call", provider=provider.name):
+                    result = provider.call(
+                        lambda: model.invoke(input, config, **kwargs),
+                        tokens=tokens,
+                        used_tokens=lambda result: self.__used_tokens(result, tokens),
+                    )
+                answered_by = _answered_by.get()
+                if answered_by is not None:
+                    answered_by.append(provider.name)
+                return result
+            except Exception as e:
+                last_error = e
+                increment_counter("yt_router_events_total", provider=provider.name, event="failover")
+
+        raise last_error
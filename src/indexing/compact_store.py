@@ -0,0 +1,321 @@
+"""
+Compact vector store
+
+A drop-in replacement of the Chroma store keeping only quantized vectors, for
+`VECTOR_STORE_MODE=int8` (4x smaller than float32) or `VECTOR_STORE_MODE=binary`
+(32x smaller searched index, 3.5x smaller in total with its re-scoring copy), on
+top of the (optional) Matryoshka truncation of `EMBEDDING_DIMENSIONS`.
+
+Vectors are grouped by video, since every search of the pipeline is filtered on a
+single `video_id`. Each video is one `CompactIndex`, persisted as a `.npz` file of
+codes and a `.json` file of chunk texts and metadata, and loaded lazily on first use.
+
+A search scores the int8 codes of the video directly against the full precision
+query. Binary codes are first ranked by their hamming distance to the binary query,
+then the `COMPACT_RERANK_CANDIDATES` best ones are re-scored against an int8 copy
+of their vectors (1 byte per dimension), kept outside the index in a `.rescore.npy`
+file which is memory mapped: only the rows of the candidates are read from disk.
+"""
+
+import os
+import json
+import uuid
+import threading
+from typing import Any, Callable, Iterable
+
+import numpy as np
+
+# Langchain imports
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain.schema import Document
+
+# Custom imports
+from src.indexing import quantization
+
+COMPACT_MODES = ("int8", "binary")
+COMPACT_RERANK_CANDIDATES = int(os.getenv("COMPACT_RERANK_CANDIDATES", "100"))
+
+
+class CompactIndex:
+    """
+    The quantized vectors, texts and metadata of a group of chunks
+
+    Example:
+        >>> index = CompactIndex("binary", dimensions=1024)
+        >>> index.add(ids, vectors, texts, metadatas)
+        >>> [(position, score), ...] = index.search(query_vector, k=4)
+    """
+
+    def __init__(self, mode: str, dimensions: int):
+        if mode not in COMPACT_MODES:
+            raise ValueError(f"Unknown compact mode '{mode}', expected one of {COMPACT_MODES}")
+        self.mode = mode
+        self.dimensions = dimensions
+        self.ids: list[str] = []
+        self.texts: list[str] = []
+        self.metadatas: list[dict] = []
+        self.codes = np.empty(
+            (0, dimensions) if mode == "int8" else (0, (dimensions + 7) // 8),
+            dtype=np.int8 if mode == "int8" else np.uint8,
+        )
+        # The int8 scales, of the codes or of the re-scoring copy
+        self.scales = np.empty(0, dtype=np.float32)
+        # The int8 codes re-scoring the binary candidates (memory mapped once saved)
+        self.rescore_codes: np.ndarray | None = (
+            np.empty((0, dimensions), dtype=np.int8) if mode == "binary" else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the vectors kept in memory (without the re-scoring copy)"""
+        return self.codes.nbytes + self.scales.nbytes
+
+    @property
+    def rescore_nbytes(self) -> int:
+        """The size of the re-scoring copy, on disk"""
+        return 0 if self.rescore_codes is None else self.rescore_codes.nbytes
+
+    def add(self, ids: list[str], vectors: np.ndarray, texts: list[str], metadatas: list[dict]) -> None:
+        vectors = quantization.normalize(vectors)
+        int8_codes, scales = quantization.quantize_int8(vectors)
+        self.scales = np.concatenate([self.scales, scales])
+        if self.mode == "int8":
+            codes = int8_codes
+        else:
+            codes = quantization.quantize_binary(vectors)
+            self.rescore_codes = np.concatenate([self.rescore_codes, int8_codes])
+        self.codes = np.concatenate([self.codes, codes])
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+
+    def search(self, query: np.ndarray, k: int, rerank_candidates: int = COMPACT_RERANK_CANDIDATES) -> list[tuple[int, float]]:
+        """
+        Args:
+            query: The full precision query vector
+            k: The number of results
+            rerank_candidates: The number of hamming results re-ranked with the full precision query (binary only)
+
+        Returns:
+            list[tuple[int, float]]: The (position, similarity) of the `k` best chunks, best first
+        """
+        if len(self) == 0:
+            return []
+        if len(query) != self.dimensions:
+            # Same message as Chroma, so the retriever resets the store the same way
+            raise ValueError(
+                f"Collection expecting embedding with dimension of {self.dimensions}, got {len(query)}"
+            )
+        query = quantization.normalize(query)
+
+        # int8 codes are scored directly against the full precision query, which gives
+        # the exact dot product with the dequantized vectors
+        if self.mode == "int8":
+            scores = (self.codes @ query) * self.scales
+            order = quantization.top_k(scores, k)
+            return [(int(position), float(scores[position])) for position in order]
+
+        # Coarse search over the binary codes, with the binary query
+        distances = quantization.hamming_distances(quantization.quantize_binary(query)[0], self.codes)
+        candidates = quantization.top_k(distances, max(k, rerank_candidates), largest=False)
+
+        # Re-rank the candidates with their int8 codes, or their signs for indexes
+        # saved without them
+        if self.rescore_codes is not None:
+            # In file order, for the reads of the memory mapped rows
+            candidates = np.sort(candidates)
+            scores = (np.asarray(self.rescore_codes[candidates]) @ query) * self.scales[candidates]
+        else:
+            vectors = quantization.unpack_binary(self.codes[candidates], self.dimensions)
+            scores = vectors @ query / np.sqrt(self.dimensions)
+        order = quantization.top_k(scores, k)
+        return [(int(candidates[index]), float(scores[index])) for index in order]
+
+    def save(self, path: str) -> None:
+        # Written aside and then moved, the previous files may still be memory mapped
+        def write(suffix: str, save: Callable[[Any], None]) -> None:
+            with open(path + suffix + ".tmp", mode="wb") as file:
+                save(file)
+            os.replace(path + suffix + ".tmp", path + suffix)
+
+        write(".npz", lambda file: np.savez(file, codes=self.codes, scales=self.scales))
+        if self.rescore_codes is not None:
+            write(".rescore.npy", lambda file: np.save(file, self.rescore_codes))
+        write(".json", lambda file: file.write(json.dumps(
+            {"mode": self.mode, "dimensions": self.dimensions, "ids": self.ids,
+             "texts": self.texts, "metadatas": self.metadatas}
+        ).encode("utf-8")))
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path + ".json", encoding="utf-8") as file:
+            data = json.load(file)
+        index = cls(data["mode"], data["dimensions"])
+        index.ids, index.texts, index.metadatas = data["ids"], data["texts"], data["metadatas"]
+        with np.load(path + ".npz") as arrays:
+            index.codes, index.scales = arrays["codes"], arrays["scales"]
+        if index.mode == "binary":
+            rescore_path = path + ".rescore.npy"
+            index.rescore_codes = (
+                np.load(rescore_path, mmap_mode="r") if os.path.isfile(rescore_path) else None
+            )
+        return index
+
+
+class CompactVectorStore(VectorStore):
+    """
+    A vector store of quantized vectors, persisted per `video_id` under
+    `<persist_directory>/compact/<collection_name>/`
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        persist_directory: str,
+        embedding_function: Embeddings,
+        mode: str = "int8",
+    ):
+        if mode not in COMPACT_MODES:
+            raise ValueError(f"Unknown compact mode '{mode}', expected one of {COMPACT_MODES}")
+        self.mode = mode
+        self.embedding_function = embedding_function
+        self.directory = os.path.join(persist_directory, "compact", collection_name)
+        os.makedirs(self.directory, exist_ok=True)
+        # video_id -> index, loaded lazily
+        self._indexes: dict[str, CompactIndex | None] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def __path(self, video_id: str) -> str:
+        return os.path.join(self.directory, video_id)
+
+    def __get_index(self, video_id: str) -> CompactIndex | None:
+        if video_id not in self._indexes:
+            path = self.__path(video_id)
+            self._indexes[video_id] = (
+                CompactIndex.load(path) if os.path.isfile(path + ".json") else None
+            )
+        return self._indexes[video_id]
+
+    def video_ids(self) -> list[str]:
+        """The videos with stored chunks"""
+        stored = {name[: -len(".json")] for name in os.listdir(self.directory) if name.endswith(".json")}
+        return sorted(stored | {video_id for video_id, index in self._indexes.items() if index})
+
+    def add_embeddings(
+        self,
+        texts: list[str],
+        embeddings: np.ndarray | list[list[float]],
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+    ) -> list[str]:
+        """
+        Stores already embedded chunks
+
+        Args:
+            texts: The chunk texts
+            embeddings: Their (n, d) embeddings
+            metadatas: Their metadata, with the `video_id` they are grouped by
+            ids: Their IDs, generated if not given
+
+        Returns:
+            list[str]: The IDs of the chunks
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+        # Group the chunks by video
+        groups: dict[str, list[int]] = {}
+        for position, metadata in enumerate(metadatas):
+            groups.setdefault(str(metadata.get("video_id", "")), []).append(position)
+
+        with self._lock:
+            for video_id, positions in groups.items():
+                index = self.__get_index(video_id)
+                if index is None or index.dimensions != vectors.shape[1]:
+                    index = self._indexes[video_id] = CompactIndex(self.mode, vectors.shape[1])
+                index.add(
+                    [ids[position] for position in positions],
+                    vectors[positions],
+                    [texts[position] for position in positions],
+                    [metadatas[position] for position in positions],
+                )
+                index.save(self.__path(video_id))
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict] | None = None,
+        *,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, filter: dict | None = None, **kwargs: Any
+    ) -> list[Document]:
+        query = np.asarray(embedding, dtype=np.float32)
+        # Only the `video_id` filter of the pipeline is supported
+        video_ids = [filter["video_id"]] if filter and "video_id" in filter else self.video_ids()
+
+        results: list[tuple[float, CompactIndex, int]] = []
+        with self._lock:
+            for video_id in video_ids:
+                index = self.__get_index(video_id)
+                if index is None:
+                    continue
+                for position, score in index.search(query, k):
+                    results.append((score, index, position))
+
+        results.sort(key=lambda result: -result[0])
+        return [
+            Document(
+                id=index.ids[position],
+                page_content=index.texts[position],
+                metadata=index.metadatas[position],
+            )
+            for _, index, position in results[:k]
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, **kwargs)
+
+    def delete_collection(self) -> None:
+        with self._lock:
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+            self._indexes.clear()
+
+    def reset_collection(self) -> None:
+        self.delete_collection()
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict] | None = None,
+        *,
+        ids: list[str] | None = None,
+        collection_name: str = "yt_store",
+        persist_directory: str = "./db",
+        mode: str = "int8",
+        **kwargs: Any,
+    ):
+        store = cls(collection_name, persist_directory, embedding, mode=mode)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
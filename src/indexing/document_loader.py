@@ -1,6 +1,4 @@
 from typing import Union, Tuple, TypedDict, Iterator
-from urllib.parse import urlparse, parse_qs
-import re
 
 # Langchain imports
 from langchain_core.document_loaders import BaseLoader
@@ -13,6 +11,8 @@ from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled
 # Custom imports
 from src.augmentation.augment_query import runnable_convert_to_english_prompt
 from src.generation.llm import runnable_generate
+from src.instrumentation.tracing import logger, span, traced
+from src.indexing.video_id import parse_video_id
 
 class InvalidYouTubeURLException(Exception):
     """Raised when the provided URL is not a valid YouTube URL."""
@@ -88,19 +88,29 @@ class YouTubeTranscriptsLoader(BaseLoader):
         for vid_id in self.video_ids:
             lang, transcript_list = self.__get_video_transcripts(vid_id)
             # Flatten the transcripts to a plain text
-            transcript = " ".join(chunk["text"] for chunk in transcript_list)
+            texts = [chunk["text"] for chunk in transcript_list]
+            transcript = " ".join(texts)
+            # Keep where every segment starts: (character offset, start in seconds)
+            timestamps, offset = [], 0
+            for chunk, text in zip(transcript_list, texts):
+                timestamps.append((offset, chunk.get("start", 0.0)))
+                offset += len(text) + 1
             # Detect the language of the documents, if we want to do so
             if lang != "en" and self.translate_to_english:
-                transcript = self.convert_if_not_english.invoke({ 'transcript': transcript })
+                with span("translate", video_id=vid_id, language=lang, length=len(transcript)):
+                    transcript = self.convert_if_not_english.invoke({ 'transcript': transcript })
+                # The offsets don't match the translation
+                timestamps = None
             # Now we need to create a document object from this
+            # (`timestamps` must be popped before storing, it isn't a valid store metadata)
             yield Document(
                 page_content=transcript,
-                metadata={"video_id": vid_id, "length": len(transcript)},
+                metadata={"video_id": vid_id, "length": len(transcript), "timestamps": timestamps},
             )
 
     @staticmethod
     def is_valid_youtube_url(
-        url: str, return_video_id: bool = True
+        url: str, return_video_id: bool = True, allow_bare_id: bool = False
     ) -> Tuple[bool, Union[str, None]]:
         """
         Validates a YouTube video URL and optionally extracts the video ID.
@@ -108,6 +118,7 @@ class YouTubeTranscriptsLoader(BaseLoader):
         Args:
             url (str): The URL to validate.
             return_video_id (bool): Whether to return the extracted video ID.
+            allow_bare_id (bool): Whether a bare 11 character video ID is also valid.
 
         Returns:
             Tuple[bool, Union[str, None]]: A tuple where the first element indicates
@@ -115,50 +126,16 @@ class YouTubeTranscriptsLoader(BaseLoader):
                 and valid, otherwise None.
 
         Raises:
-            InvalidYouTubeURLException: If the URL is malformed or does not match
-                YouTube video URL format.
+            TypeError: If the URL is not a string.
         """
 
         if not isinstance(url, str):
             raise TypeError("URL must be a string.")
 
-        # Regex for matching YouTube video URLs
-        pattern = (
-            r"(?:https?:\/\/)?"  # optional scheme
-            r"(?:[0-9A-Z-]+\.)?"  # optional subdomain
-            r"(?:youtube|youtu|youtube-nocookie)\.(?:com|be)\/"  # domain
-            r"(?:watch\?v=|watch\?.+&v=|embed\/|v\/|.+\?v=)?"  # path or query
-            r"([^&=\n%\?]{11})"  # capture group for video ID
-        )
-
-        match = re.search(pattern, url, re.IGNORECASE)
-        if not match:
+        video_id = parse_video_id(url, allow_bare_id=allow_bare_id)
+        if video_id is None:
             return False, None
-
-        try:
-            # Try parsing to get the video ID in a more robust way
-            parsed_url = urlparse(url)
-
-            video_id = None
-
-            # Handle different URL styles
-            if "youtube.com" in parsed_url.netloc:
-                query_params = parse_qs(parsed_url.query)
-                video_id_list = query_params.get("v")
-                if video_id_list:
-                    video_id = video_id_list[0]
-                elif "/shorts/" in parsed_url.path:
-                    video_id = parsed_url.path.split("/shorts/")[-1].split("/")[0]
-            elif "youtu.be" in parsed_url.netloc:
-                video_id = parsed_url.path.lstrip("/")
-
-            # Final check: video_id must be 11 characters
-            if video_id and len(video_id) == 11:
-                return True, video_id if return_video_id else None
-            else:
-                return False, None
-        except Exception as e:
-            raise InvalidYouTubeURLException(f"Error parsing URL: {e}")
+        return True, video_id if return_video_id else None
 
     @staticmethod
     def get_video_id(yt_video_url: str):
@@ -167,9 +144,9 @@ class YouTubeTranscriptsLoader(BaseLoader):
             raise ValueError("Both `yt_video_url` cannot be None") from yt_video_url
 
         video_id = None
-        # Check if the url is a valid one
+        # Check if the url is a valid one (or already a video ID, e.g. from the bulk ingestion)
         is_valid, video_id = YouTubeTranscriptsLoader.is_valid_youtube_url(
-            yt_video_url, return_video_id=True
+            yt_video_url, return_video_id=True, allow_bare_id=True
         )
         # If the url is not valid, raise
         if not is_valid:
@@ -186,6 +163,7 @@ class YouTubeTranscriptsLoader(BaseLoader):
 
     # Private Methods
 
+    @traced("transcript_fetch")
     def __get_video_transcripts(self, video_id: str):
         """
         Tries to get the transcripts of the video, if not available, it will try to get the transcripts of the video in next available language
@@ -206,22 +184,54 @@ class YouTubeTranscriptsLoader(BaseLoader):
                 )
                 return (lang, transcript_list)
             except TranscriptsDisabled as tde:
-                print(f"[DEBUG]: Transcripts are disabled for this video in {lang} language")
+                logger.debug("Transcripts are disabled for video '%s' in %s language", video_id, lang)
 
         if transcript_list is None:
             raise Exception("No captions available for this video.")
 
 
+"""
+The Runnable for resolving the video ID, once, at the entry of the pipeline
+"""
+
+class ResolveVideoIdInputs(TypedDict):
+    video_url: str
+
+
+class ResolveVideoIdOutputs(TypedDict):
+    video_url: str
+    video_id: str
+
+
+def __resolve_video_id(inputs: ResolveVideoIdInputs) -> ResolveVideoIdOutputs:
+    """
+    Normalizes the given video URL to its canonical video ID
+    Args:
+        inputs: { video_url: str }
+    Returns:
+        outputs: { video_url: str, video_id: str }
+    Raises:
+        ValueError: If the URL is not a valid YouTube video URL
+    """
+    inputs["video_id"] = YouTubeTranscriptsLoader.get_video_id(inputs["video_url"])
+    return inputs
+
+
+runnable_resolve_video_id = RunnableLambda(__resolve_video_id)
+
+
 """
 The Runnable for loading documents
 """
 
 class LoadDocumentsInputs(TypedDict):
     video_url: str
+    video_id: str
 
 
 class LoadDocumentOutputs(TypedDict):
     video_url: str
+    video_id: str
     docs: Iterator[Document]
 
 
@@ -230,15 +240,13 @@ def __load_documents(inputs: LoadDocumentsInputs) -> LoadDocumentOutputs:
     """
     Load documents as transcripts of the given YouTube Video(s)
     Args:
-        inputs: { video_url: str }
+        inputs: { video_url: str, video_id: str }
     Returns:
-        outputs: { video_url: str, docs: Iterator[Document] }
+        outputs: { video_url: str, video_id: str, docs: Iterator[Document] }
     """
-    # Print for a debug statement
-    print(f"[DEBUG]: Loading transcripts from url='{inputs['video_url']}'")
     # Load all the documents
     inputs["docs"] = YouTubeTranscriptsLoader(
-        yt_video_urls=[inputs["video_url"]]
+        yt_video_urls=[inputs.get("video_id") or inputs["video_url"]]
     ).lazy_load()
     
     return inputs
@@ -0,0 +1,130 @@
+"""
+Local CPU embeddings
+
+Embeds with a `sentence-transformers` model on the local CPU: no network latency,
+no per token cost, works offline, and the ingestion throughput is bounded by the
+cores instead of the API rate limits. Selected with `EMBEDDINGS_PROVIDER=local`.
+
+The model is downloaded (once) and loaded lazily on the first call, then shared by
+every thread of the process. `LOCAL_EMBEDDINGS_BACKEND=onnx` runs it with ONNX
+Runtime instead of torch (it needs `optimum[onnxruntime]`), and
+`LOCAL_EMBEDDINGS_ONNX_FILE` picks one of the exported files of the model, e.g. an
+int8 quantized `onnx/model_qint8_avx512.onnx`.
+
+Configuration (environment):
+- LOCAL_EMBEDDINGS_MODEL: the model (default "sentence-transformers/all-MiniLM-L6-v2")
+- LOCAL_EMBEDDINGS_BATCH_SIZE: the texts encoded at once (default 32)
+- LOCAL_EMBEDDINGS_THREADS: the intra-op threads (of torch, or of the ONNX Runtime
+  session), unset for the default of one per core
+- LOCAL_EMBEDDINGS_BACKEND: "torch" (default) or "onnx"
+- LOCAL_EMBEDDINGS_ONNX_FILE: the ONNX file of the model to load, unset for `onnx/model.onnx`
+"""
+
+import os
+import threading
+
+import numpy as np
+
+# Langchain imports
+from langchain_core.embeddings import Embeddings
+
+# Custom imports
+from src.instrumentation.tracing import span
+
+# CONFIGURATION for the local model
+LOCAL_EMBEDDINGS_MODEL = os.getenv("LOCAL_EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBEDDINGS_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDINGS_BATCH_SIZE", "32"))
+LOCAL_EMBEDDINGS_THREADS: int | None = (
+    int(os.environ["LOCAL_EMBEDDINGS_THREADS"]) if os.getenv("LOCAL_EMBEDDINGS_THREADS") else None
+)
+LOCAL_EMBEDDINGS_BACKEND = os.getenv("LOCAL_EMBEDDINGS_BACKEND", "torch")
+LOCAL_EMBEDDINGS_ONNX_FILE: str | None = os.getenv("LOCAL_EMBEDDINGS_ONNX_FILE") or None
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    A `sentence-transformers` model run on the local CPU, loaded on first use
+
+    Example:
+        >>> embeddings = LocalEmbeddings()
+        >>> embeddings.encode(["first chunk", "second chunk"]).shape
+        (2, 384)
+    """
+
+    def __init__(
+        self,
+        model: str = LOCAL_EMBEDDINGS_MODEL,
+        batch_size: int = LOCAL_EMBEDDINGS_BATCH_SIZE,
+        threads: int | None = LOCAL_EMBEDDINGS_THREADS,
+        backend: str = LOCAL_EMBEDDINGS_BACKEND,
+        onnx_file: str | None = LOCAL_EMBEDDINGS_ONNX_FILE,
+    ):
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown backend '{backend}', expected 'torch' or 'onnx'")
+        self.model_name = model
+        self.batch_size = batch_size
+        self.threads = threads
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __load(self):
+        # Imported here, so the remote providers don't pay for importing torch
+        from sentence_transformers import SentenceTransformer
+
+        kwargs = {}
+        if self.backend == "onnx":
+            model_kwargs = {}
+            if self.onnx_file:
+                model_kwargs["file_name"] = self.onnx_file
+            if self.threads:
+                # ONNX Runtime ignores the torch setting, and starts a thread per core
+                import onnxruntime
+
+                session_options = onnxruntime.SessionOptions()
+                session_options.intra_op_num_threads = self.threads
+                model_kwargs["session_options"] = session_options
+            kwargs["backend"] = "onnx"
+            if model_kwargs:
+                kwargs["model_kwargs"] = model_kwargs
+        elif self.threads:
+            import torch
+
+            torch.set_num_threads(self.threads)
+
+        with span("embedding_model_load", model=self.model_name, backend=self.backend):
+            return SentenceTransformer(self.model_name, device="cpu", **kwargs)
+
+    @property
+    def model(self):
+        """The model, loaded once (even if several threads ask for it at the same time)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self.__load()
+        return self._model
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        Args:
+            texts: The texts to embed
+
+        Returns:
+            np.ndarray: Their (n, d) float32 unit vectors
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([text])[0].tolist()
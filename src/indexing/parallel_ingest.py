@@ -0,0 +1,324 @@
+"""
+Multi-process ingestion of many videos (backfills)
+
+The CPU bound parts of the ingestion (joining the transcript segments, splitting,
+and encoding with local embeddings) hold the GIL, so a single process only ever
+uses one core. `ingest_videos` fans them out to a pool of worker processes:
+- every worker fetches, splits and embeds one video at a time, and writes the
+  embeddings to a `multiprocessing.shared_memory` block instead of pickling them
+- the calling process is the single writer: it maps every block without copying
+  it, stores the chunks and frees the block. Chroma (SQLite) never sees two writers.
+
+Every worker creates its own embedding function, so the client side rate limits of
+the remote providers apply per worker: this mode is meant for `EMBEDDINGS_PROVIDER=local`.
+The workers don't write the trace log (only the calling process does), so that they
+don't append to and rotate the same file.
+
+Configuration (environment):
+- INGEST_WORKERS: the number of worker processes (default: the number of cores)
+- LOCAL_EMBEDDINGS_THREADS: if set, caps the torch threads of every worker (which
+  otherwise get an equal share of the cores)
+
+Usage:
+    python -m src.indexing.parallel_ingest https://youtu.be/4g-fPNjizrw dQw4w9WgXcQ ...
+    python -m src.indexing.parallel_ingest --file video_urls.txt --workers 16
+"""
+
+import os
+import uuid
+import argparse
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, TypedDict
+
+# Load all the env variables (in the workers too)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import numpy as np
+
+# Custom imports
+from src.indexing.compact_store import CompactVectorStore
+from src.indexing.local_embeddings import LOCAL_EMBEDDINGS_THREADS
+from src.indexing.document_loader import YouTubeTranscriptsLoader
+from src.indexing.text_splitter import split_documents
+from src.indexing.vectorstore import (
+    add_embeddings,
+    encode_documents,
+    get_embedding_function,
+    get_vector_store,
+)
+from src.indexing.video_id import parse_video_ids
+from src.generation.artifacts import enqueue_artifacts
+from src.instrumentation import tracing
+from src.instrumentation.tracing import logger, span
+
+# CONFIGURATION for the parallel ingestion
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+
+class EmbeddedVideo(TypedDict):
+    """What a worker sends back to the writer, the embeddings stay in shared memory"""
+
+    video_id: str
+    shared_memory_name: str | None
+    shape: tuple[int, int]
+    texts: list[str]
+    metadatas: list[dict]
+    transcripts: list[tuple[str, list[tuple[int, float]] | None]]
+
+
+class IngestReport(TypedDict):
+    ingested: list[str]
+    skipped: list[str]
+    failed: dict[str, str]
+    n_chunks: int
+
+
+"""
+The workers
+"""
+
+
+# The torch threads of this worker process, set by `__init_worker`
+__worker_threads: int | None = None
+
+
+def __init_worker(threads: int) -> None:
+    # Don't let every worker spawn a thread per core, the local embeddings of the
+    # worker get the same count (instead of `LOCAL_EMBEDDINGS_THREADS`)
+    global __worker_threads
+    __worker_threads = threads
+    # A single writer for the trace log, and its rotation
+    tracing.TRACE_LOG_FILE = ""
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def __embed_video(video_id: str) -> EmbeddedVideo:
+    """
+    Fetches, splits and embeds one video, in a worker process
+    Args:
+        video_id: The video
+    Returns:
+        EmbeddedVideo: The chunks, and the shared memory block of their (n, d) float32 embeddings
+    """
+    docs = list(YouTubeTranscriptsLoader(yt_video_urls=[video_id]).lazy_load())
+    chunks, timestamps = split_documents(docs)
+    texts = [chunk.page_content for chunk in chunks]
+
+    result: EmbeddedVideo = {
+        "video_id": video_id,
+        "shared_memory_name": None,
+        "shape": (0, 0),
+        "texts": texts,
+        "metadatas": [chunk.metadata for chunk in chunks],
+        "transcripts": [(doc.page_content, doc_timestamps) for doc, doc_timestamps in zip(docs, timestamps)],
+    }
+    if not texts:
+        return result
+
+    # The array of the model, copied once into the block
+    embeddings = encode_documents(get_embedding_function(local_threads=__worker_threads), texts)
+    block = shared_memory.SharedMemory(create=True, size=embeddings.nbytes)
+    np.ndarray(embeddings.shape, dtype=np.float32, buffer=block.buf)[:] = embeddings
+    # The writer unlinks the block once stored
+    block.close()
+    result["shared_memory_name"], result["shape"] = block.name, embeddings.shape
+    return result
+
+
+"""
+The writer
+"""
+
+
+def is_ingested(vectorstore, video_id: str) -> bool:
+    """Whether the store already has chunks of the video"""
+    if isinstance(vectorstore, CompactVectorStore):
+        return video_id in vectorstore.video_ids()
+    return bool(vectorstore.get(where={"video_id": video_id}, limit=1)["ids"])
+
+
+def __is_dimension_mismatch(error: Exception) -> bool:
+    # Same check as the retriever
+    return str(error).startswith("Collection expecting embedding with dimension of") and "got" in str(error)
+
+
+def __write(vectorstore, result: EmbeddedVideo, embeddings: np.ndarray) -> None:
+    ids = [uuid.uuid4().hex for _ in result["texts"]]
+    with span("store", video_id=result["video_id"], n_chunks=len(ids)):
+        add_embeddings(vectorstore, result["texts"], embeddings, result["metadatas"], ids)
+
+
+def __store(vectorstore, result: EmbeddedVideo, on_reset: Callable[[], None]) -> int:
+    """
+    Stores the chunks of one video, and frees its shared memory block
+    Args:
+        vectorstore: The store
+        result: The embedded video
+        on_reset: Called if the store had to be reset, for a change of embedding dimension
+    Returns:
+        int: The number of stored chunks
+    """
+    if result["shared_memory_name"] is None:
+        return 0
+
+    block = shared_memory.SharedMemory(name=result["shared_memory_name"])
+    # A view of the block, not a copy
+    embeddings = np.ndarray(result["shape"], dtype=np.float32, buffer=block.buf)
+    try:
+        try:
+            __write(vectorstore, result, embeddings)
+        except Exception as e:
+            if not __is_dimension_mismatch(e):
+                raise
+            # The embedding model changed: reset the store like the retriever does
+            logger.warning("Embedding dimension changed, resetting the vector store: %s", e)
+            vectorstore.reset_collection()
+            on_reset()
+            __write(vectorstore, result, embeddings)
+    finally:
+        # The view must be gone before closing the block
+        del embeddings
+        block.unlink()
+        block.close()
+    return len(result["texts"])
+
+
+def __release(future: Future) -> None:
+    # Frees the shared memory of a result which won't be stored
+    if not future.cancelled() and future.exception() is None:
+        name = future.result()["shared_memory_name"]
+        if name is not None:
+            block = shared_memory.SharedMemory(name=name)
+            block.unlink()
+            block.close()
+
+
+def ingest_videos(
+    video_urls: Iterable[str],
+    workers: int = INGEST_WORKERS,
+    skip_existing: bool = True,
+) -> IngestReport:
+    """
+    Ingests many videos with a pool of worker processes, the calling process being
+    the only one writing to the vector store
+
+    Args:
+        video_urls: The YouTube video URLs or IDs
+        workers: The number of worker processes
+        skip_existing: Don't ingest the videos already in the store
+
+    Returns:
+        IngestReport: The ingested, skipped and failed (with the error) videos, and the number of stored chunks
+    """
+    report: IngestReport = {"ingested": [], "skipped": [], "failed": {}, "n_chunks": 0}
+    vectorstore = get_vector_store()
+
+    # Resolve, and deduplicate the videos
+    video_urls = list(video_urls)
+    video_ids: list[str] = []
+    seen: set[str] = set()
+    for video_url, video_id in zip(video_urls, parse_video_ids(video_urls)):
+        if video_id is None:
+            report["failed"][video_url] = "Invalid YouTube video URL"
+        elif video_id in seen:
+            continue
+        else:
+            seen.add(video_id)
+            if skip_existing and is_ingested(vectorstore, video_id):
+                report["skipped"].append(video_id)
+            else:
+                video_ids.append(video_id)
+    if not video_ids:
+        return report
+
+    workers = max(1, min(workers, len(video_ids)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if LOCAL_EMBEDDINGS_THREADS:
+        threads = min(threads, LOCAL_EMBEDDINGS_THREADS)
+    # "spawn": the workers mustn't inherit the threads (and locks) of this process
+    context = multiprocessing.get_context("spawn")
+
+    with span("parallel_ingest", n_videos=len(video_ids), workers=workers) as attributes:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=__init_worker,
+            initargs=(threads,),
+        ) as executor:
+            # Bound the videos in flight, so does the shared memory waiting to be stored
+            pending: dict[Future, str] = {}
+            queue = deque(video_ids)
+
+            def requeue_skipped():
+                # The reset store lost the videos skipped so far
+                queue.extend(report["skipped"])
+                report["skipped"] = []
+
+            try:
+                while queue or pending:
+                    while queue and len(pending) < 2 * workers:
+                        video_id = queue.popleft()
+                        pending[executor.submit(__embed_video, video_id)] = video_id
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        video_id = pending.pop(future)
+                        try:
+                            result = future.result()
+                            report["n_chunks"] += __store(vectorstore, result, requeue_skipped)
+                        except Exception as e:
+                            logger.warning("Couldn't ingest video '%s': %s", video_id, e)
+                            report["failed"][video_id] = str(e)
+                            continue
+                        report["ingested"].append(video_id)
+
+                        # Generate the summary, outline... in the background (if enabled)
+                        for transcript, timestamps in result["transcripts"]:
+                            enqueue_artifacts(video_id, transcript, timestamps)
+            finally:
+                for future in pending:
+                    future.cancel()
+                for future in wait(pending).done:
+                    __release(future)
+        attributes["n_chunks"] = report["n_chunks"]
+
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Ingests many YouTube videos with a pool of worker processes")
+    parser.add_argument("video_urls", nargs="*", help="YouTube video URLs or IDs")
+    parser.add_argument("--file", help="A file with one YouTube video URL or ID per line")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--force", action="store_true", help="Also ingest the videos already in the store")
+    args = parser.parse_args()
+
+    video_urls = list(args.video_urls)
+    if args.file:
+        with open(args.file, encoding="utf-8") as file:
+            video_urls += [line.strip() for line in file if line.strip()]
+    if not video_urls:
+        parser.error("No video to ingest")
+
+    report = ingest_videos(video_urls, workers=args.workers, skip_existing=not args.force)
+    print(
+        f"Ingested {len(report['ingested'])} video(s) ({report['n_chunks']} chunks), "
+        f"skipped {len(report['skipped'])} already stored, {len(report['failed'])} failed"
+    )
+    for video, error in report["failed"].items():
+        print(f"[ERROR]: {video}: {error}")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    exit(main())
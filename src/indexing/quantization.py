@@ -0,0 +1,90 @@
+"""
+Embedding compression helpers
+
+- Matryoshka style truncation: keep the first dimensions of a vector and renormalize.
+  Only meaningful for models trained for it (e.g. `text-embedding-3-*`).
+- int8 quantization: one signed byte per dimension and a float32 scale per vector (4x smaller)
+- binary quantization: one bit (the sign) per dimension (32x smaller)
+
+Binary vectors are searched in two steps: a cheap coarse search by hamming distance,
+and a re-rank of the top candidates by their dot product with the full precision query.
+"""
+
+import numpy as np
+
+# Popcount of every byte, for numpy versions without `np.bitwise_count`
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scales every row to unit length (zero rows are left as they are)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def truncate(vectors: np.ndarray, dimensions: int | None) -> np.ndarray:
+    """Keeps the first `dimensions` of every vector, and renormalizes them"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or dimensions >= vectors.shape[-1]:
+        return vectors
+    return normalize(vectors[..., :dimensions])
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per vector int8 quantization
+
+    Args:
+        vectors: (n, d) float vectors
+
+    Returns:
+        (codes, scales): (n, d) int8 codes, and the (n,) float32 scales such that
+            `vectors ~= codes * scales[:, None]`
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """The float32 approximation of int8 codes"""
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        vectors: (n, d) float vectors
+
+    Returns:
+        np.ndarray: (n, ceil(d / 8)) uint8, the packed signs of the vectors
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return np.packbits(vectors > 0, axis=1)
+
+
+def unpack_binary(packed: np.ndarray, dimensions: int) -> np.ndarray:
+    """The +1 / -1 float32 vectors of packed signs"""
+    bits = np.unpackbits(packed, axis=1, count=dimensions)
+    return bits.astype(np.float32) * 2 - 1
+
+
+def hamming_distances(packed_query: np.ndarray, packed: np.ndarray) -> np.ndarray:
+    """The number of different bits between one packed query and every packed row"""
+    xor = np.bitwise_xor(packed, packed_query.reshape(1, -1))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[xor].sum(axis=1, dtype=np.int32)
+
+
+def top_k(scores: np.ndarray, k: int, largest: bool = True) -> np.ndarray:
+    """The indices of the `k` best scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    keys = -scores if largest else scores
+    candidates = np.argpartition(keys, k - 1)[:k]
+    return candidates[np.argsort(keys[candidates], kind="stable")]
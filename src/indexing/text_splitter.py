@@ -7,6 +7,8 @@ from langchain_core.runnables import RunnableLambda
 
 # Custom modules
 from src.indexing.vectorstore import get_vector_store, Chroma
+from src.generation.artifacts import enqueue_artifacts
+from src.instrumentation.tracing import span, traced
 
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 0.20 * CHUNK_SIZE
@@ -26,6 +28,7 @@ class FormatDocumentOutputs(TypedDict):
     query: str
 
 
+@traced("format_documents")
 def __format_documents(inputs: FormatDocumentsInputs) -> FormatDocumentOutputs:
     """
     Format the chunks of documents into a string with paragraph formatting
@@ -34,9 +37,6 @@ def __format_documents(inputs: FormatDocumentsInputs) -> FormatDocumentOutputs:
     Returns:
         outputs: { context: str, query: str }
     """
-    # Print for the debug
-    print(f"[DEBUG]: Formatting chunks into context...")
-
     formatted_text = "\n\n".join(chunk.page_content for chunk in inputs["chunks"])
     inputs["context"] = formatted_text
     return inputs
@@ -49,6 +49,28 @@ Splits the documents and returns embedding vectors
 """
 
 
+def split_documents(
+    docs: list[Document],
+) -> tuple[list[Document], list[list[tuple[int, float]] | None]]:
+    """
+    Splits the transcripts into the chunks to embed (shared with the parallel ingestion)
+    Args:
+        docs: The transcripts of the loader
+    Returns:
+        (chunks, timestamps): The chunks, and the segment timestamps popped from every transcript
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    # Don't store the segment timestamps with every chunk
+    timestamps = [doc.metadata.pop("timestamps", None) for doc in docs]
+    # Split the documents
+    with span("split") as attributes:
+        chunks = splitter.split_documents(docs)
+        attributes["n_chunks"] = len(chunks)
+    return chunks, timestamps
+
+
 # The required inputs for this chain is `documents`
 class SplitEmbedAndStoreInputs(TypedDict):
     query: str
@@ -62,6 +84,7 @@ class SplitEmbedAndStoreOutput(TypedDict):
     video_url: str
 
 
+@traced("split_embed_and_store")
 def __split_embed_and_store(
     inputs: SplitEmbedAndStoreInputs,
 ) -> SplitEmbedAndStoreOutput:
@@ -72,18 +95,18 @@ def __split_embed_and_store(
     Returns:
         output: { query: str, video_url: str }
     """
-    # Print for a debug statement
-    print(f"[DEBUG]: Creating chunks and storing...")
-
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
-    )
-    # Split the documents
-    chunks = splitter.split_documents(inputs["docs"])
+    # Pull the transcripts through the loader, and split them
+    docs = list(inputs["docs"])
+    chunks, timestamps = split_documents(docs)
     # Get the vector store
     vectorstore = get_vector_store()
     # Add the chunks to the vector store
-    vectorstore.add_documents(chunks)
+    with span("store", n_chunks=len(chunks)):
+        vectorstore.add_documents(chunks)
+
+    # Generate the summary, outline... of the videos in the background (if enabled)
+    for doc, doc_timestamps in zip(docs, timestamps):
+        enqueue_artifacts(doc.metadata["video_id"], doc.page_content, doc_timestamps)
     return inputs
 
 
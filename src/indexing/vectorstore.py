@@ -1,12 +1,23 @@
 import os
+from functools import lru_cache
 from typing import TypedDict, Callable
+
+import numpy as np
 from langchain_chroma import Chroma
 from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
 
 # To get the embedding function
 from langchain_openai import OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
 
+# Custom imports
+from src.generation.router import ResilientProvider
+from src.indexing import quantization
+from src.indexing.compact_store import COMPACT_MODES, CompactVectorStore
+from src.indexing.local_embeddings import LOCAL_EMBEDDINGS_MODEL, LocalEmbeddings
+from src.instrumentation.tracing import span, record_usage, estimate_tokens
+
 
 class VectorstoreInputs(TypedDict):
     chunks: list[Document]
@@ -26,6 +37,13 @@ PERSIST_DIRECTORY = "./db"
 if not os.path.isdir(PERSIST_DIRECTORY):
     os.makedirs(PERSIST_DIRECTORY)
 
+# "chroma" (full precision), or one of the compact modes "int8" / "binary"
+VECTOR_STORE_MODE = os.getenv("VECTOR_STORE_MODE", "chroma")
+# Matryoshka style truncation of the embeddings, unset to keep every dimension
+EMBEDDING_DIMENSIONS: int | None = (
+    int(os.environ["EMBEDDING_DIMENSIONS"]) if os.getenv("EMBEDDING_DIMENSIONS") else None
+)
+
 # The API keys for our models
 OPENAI_API_KEY: str | None = os.getenv("OPENAI_API_KEY")
 HUGGINGFACEHUB_API_TOKEN: str | None = os.getenv("HUGGINGFACEHUB_API_TOKEN")
@@ -37,38 +55,216 @@ if HUGGINGFACEHUB_API_TOKEN:
     login(HUGGINGFACEHUB_API_TOKEN)
 
 
-# Get the embedding model
-def get_embedding_function():
-    # The precedence goes like
+def encode_documents(embeddings: Embeddings, texts: list[str]) -> np.ndarray:
+    """
+    Embeds the texts into a (n, d) float32 array, without the round trip through
+    Python lists when the model computes an array (the local model)
+
+    Args:
+        embeddings: The embedding model
+        texts: The texts to embed
+
+    Returns:
+        np.ndarray: Their (n, d) float32 embeddings
+    """
+    encode = getattr(embeddings, "encode", None)
+    if encode is not None:
+        return encode(texts)
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model to record a span, the (estimated) token usage and
+    cost of every call
+    """
+
+    def __init__(self, embeddings: Embeddings, provider: str, model: str):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with span("embed_documents", n_texts=len(texts)):
+            record_usage("embedding", self.provider, self.model, estimate_tokens(texts))
+            return self.embeddings.embed_documents(texts)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """`embed_documents`, as a (n, d) float32 array"""
+        with span("embed_documents", n_texts=len(texts)):
+            record_usage("embedding", self.provider, self.model, estimate_tokens(texts))
+            return encode_documents(self.embeddings, texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        with span("embed_query"):
+            record_usage("embedding", self.provider, self.model, estimate_tokens([text]))
+            return self.embeddings.embed_query(text)
+
+
+class ResilientEmbeddings(Embeddings):
+    """
+    Calls an embedding model within the quota of its provider, retrying rate limits
+    and transient errors. There is no failover to another provider: every vector of
+    the store must come from the same model.
+    """
+
+    def __init__(self, embeddings: Embeddings, provider: ResilientProvider):
+        self.embeddings = embeddings
+        self.provider = provider
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.provider.call(
+            lambda: self.embeddings.embed_documents(texts), tokens=estimate_tokens(texts)
+        )
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.provider.call(
+            lambda: self.embeddings.embed_query(text), tokens=estimate_tokens([text])
+        )
+
+
+class TruncatedEmbeddings(Embeddings):
+    """
+    Keeps the first `dimensions` of the vectors of an embedding model, renormalized.
+    Only use it with models trained for it (Matryoshka representation learning).
+    """
+
+    def __init__(self, embeddings: Embeddings, dimensions: int):
+        self.embeddings = embeddings
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self.embeddings.embed_documents(texts)
+        return quantization.truncate(vectors, self.dimensions).tolist()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """`embed_documents`, as a (n, d) float32 array"""
+        return quantization.truncate(encode_documents(self.embeddings, texts), self.dimensions)
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.embeddings.embed_query(text)
+        return quantization.truncate(vector, self.dimensions).tolist()
+
+
+# Get the embedding model (once per process, so its rate limiter is shared by every call)
+@lru_cache(maxsize=None)
+def get_embedding_function(local_threads: int | None = None):
+    """
+    Args:
+        local_threads: The torch threads of the local embeddings, instead of `LOCAL_EMBEDDINGS_THREADS`
+            (e.g. the share of the cores of an ingestion worker)
+    """
+    # Either the provider set in `EMBEDDINGS_PROVIDER`, or the precedence goes like
     # OpenAI, HuggingFace
     OPENAI_API_KEY: str | None = os.getenv("OPENAI_API_KEY")
     HUGGINGFACEHUB_API_TOKEN: str | None = os.getenv("HUGGINGFACEHUB_API_TOKEN")
+    provider = os.getenv("EMBEDDINGS_PROVIDER") or (
+        "openai" if OPENAI_API_KEY else "huggingface" if HUGGINGFACEHUB_API_TOKEN else None
+    )
 
     # First preference
-    if OPENAI_API_KEY:
-        return OpenAIEmbeddings(
-            model=os.getenv("OPENAI_EMBEDDINGS_MODEL", "text-embedding-3-large")
+    if provider == "openai":
+        model = os.getenv("OPENAI_EMBEDDINGS_MODEL", "text-embedding-3-large")
+        return InstrumentedEmbeddings(
+            ResilientEmbeddings(
+                # The `text-embedding-3-*` models truncate natively
+                OpenAIEmbeddings(model=model, dimensions=EMBEDDING_DIMENSIONS),
+                ResilientProvider.from_env("openai", "OPENAI_EMBEDDINGS"),
+            ),
+            "openai",
+            model,
         )
 
     # Second preference
-    if HUGGINGFACEHUB_API_TOKEN:
-        return HuggingFaceEndpointEmbeddings(
-            model=os.getenv(
-                "HUGGINGFACE_EMBEDDINGS_MODEL", "intfloat/e5-mistral-7b-instruct"
-            ),
+    if provider == "huggingface":
+        model = os.getenv(
+            "HUGGINGFACE_EMBEDDINGS_MODEL", "intfloat/e5-mistral-7b-instruct"
+        )
+        embeddings = HuggingFaceEndpointEmbeddings(
+            model=model,
             task="feature-extraction",
             huggingfacehub_api_token=HUGGINGFACEHUB_API_TOKEN,
         )
+        if EMBEDDING_DIMENSIONS:
+            embeddings = TruncatedEmbeddings(embeddings, EMBEDDING_DIMENSIONS)
+        return InstrumentedEmbeddings(
+            ResilientEmbeddings(
+                embeddings,
+                ResilientProvider.from_env("huggingface", "HUGGINGFACE_EMBEDDINGS"),
+            ),
+            "huggingface",
+            model,
+        )
+
+    # On the local CPU, only when asked for (no rate limits to respect)
+    if provider == "local":
+        embeddings = LocalEmbeddings(threads=local_threads) if local_threads else LocalEmbeddings()
+        if EMBEDDING_DIMENSIONS:
+            embeddings = TruncatedEmbeddings(embeddings, EMBEDDING_DIMENSIONS)
+        return InstrumentedEmbeddings(embeddings, "local", LOCAL_EMBEDDINGS_MODEL)
 
+    if provider is not None:
+        raise EnvironmentError(
+            f"Unknown EMBEDDINGS_PROVIDER '{provider}', expected 'openai', 'huggingface' or 'local'"
+        )
     raise EnvironmentError(
-        "Neither API Key set for OPENAI nor HUGGINGFACE\nSet `OPENAI_API_KEY` or `HUGGINGFACEHUB_API_TOKEN` in your environment"
+        "Neither API Key set for OPENAI nor HUGGINGFACE\nSet `OPENAI_API_KEY` or `HUGGINGFACEHUB_API_TOKEN` in your environment, or `EMBEDDINGS_PROVIDER=local`"
     )
 
 
-# Returns the currently used store
+# Returns the currently used store (created once per process and location, it's
+# shared by every request and thread)
 def get_vector_store():
+    return __get_vector_store(COLLECTION_NAME, PERSIST_DIRECTORY, VECTOR_STORE_MODE)
+
+
+@lru_cache(maxsize=None)
+def __get_vector_store(collection_name: str, persist_directory: str, mode: str):
+    # The compact store of quantized vectors
+    if mode in COMPACT_MODES:
+        return CompactVectorStore(
+            collection_name=collection_name,
+            persist_directory=persist_directory,
+            embedding_function=get_embedding_function(),
+            mode=mode,
+        )
+
     return Chroma(
-        collection_name=COLLECTION_NAME,
-        persist_directory=PERSIST_DIRECTORY,
+        collection_name=collection_name,
+        persist_directory=persist_directory,
         embedding_function=get_embedding_function(),
     )
+
+
+def add_embeddings(
+    vectorstore,
+    texts: list[str],
+    embeddings: np.ndarray,
+    metadatas: list[dict],
+    ids: list[str],
+) -> None:
+    """
+    Stores already embedded chunks, in either kind of store
+
+    Args:
+        vectorstore: The store, Chroma or compact
+        texts: The chunk texts
+        embeddings: Their (n, d) embeddings
+        metadatas: Their metadata
+        ids: Their IDs
+    """
+    if isinstance(vectorstore, CompactVectorStore):
+        vectorstore.add_embeddings(texts, embeddings, metadatas, ids)
+        return
+
+    # Chroma embeds the texts itself in `add_texts`, the collection takes the vectors
+    # as they are, within the batch size limit of the client
+    batch_size = vectorstore._client.get_max_batch_size()
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        vectorstore._collection.upsert(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end],
+            metadatas=metadatas[start:end],
+            documents=texts[start:end],
+        )
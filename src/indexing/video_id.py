@@ -0,0 +1,69 @@
+"""
+YouTube video ID extraction
+
+A single precompiled pattern covering every URL form we accept, memoized (for
+single URLs) so the same URL is only ever parsed once per process:
+- https://www.youtube.com/watch?v=<id>   (also with other query parameters first)
+- https://m.youtube.com/watch?v=<id>, https://music.youtube.com/watch?v=<id>
+- https://youtu.be/<id>
+- https://www.youtube.com/embed/<id>, /v/<id>, /e/<id>, /live/<id>, /shorts/<id>
+- https://www.youtube-nocookie.com/embed/<id>
+- the bare 11 character <id> itself, unless `allow_bare_id=False` (user input
+  validation, where any 11 letter word would pass)
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable
+
+# The ID is always 11 characters of [A-Za-z0-9_-], the host and path are case insensitive
+VIDEO_URL_PATTERN = re.compile(
+    r"(?<![\w-])"  # not in the middle of another domain
+    r"(?i:(?:https?://)?(?:[0-9a-z-]+\.)?"  # optional scheme and subdomain
+    r"(?:youtube(?:-nocookie)?\.com/"  # domain
+    r"(?:watch/?\?(?:[^#]*?&(?:amp;)?)?v=|embed/|v/|e/|live/|shorts/)"  # path or query
+    r"|youtu\.be/))"  # short domain
+    r"([A-Za-z0-9_-]{11})"  # capture group for video ID
+    r"(?![A-Za-z0-9_-])"  # which must not continue
+)
+
+VIDEO_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{11}")
+
+
+def __parse_video_id(url: str, allow_bare_id: bool) -> str | None:
+    url = url.strip()
+    if allow_bare_id and VIDEO_ID_PATTERN.fullmatch(url):
+        return url
+
+    match = VIDEO_URL_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+@lru_cache(maxsize=65536)
+def parse_video_id(url: str, allow_bare_id: bool = True) -> str | None:
+    """
+    Extracts the canonical video ID from a YouTube URL (or a bare video ID)
+
+    Args:
+        url (str): The URL or ID to parse
+        allow_bare_id (bool): Whether a bare 11 character ID is accepted, else only URLs are
+
+    Returns:
+        str | None: The 11 character video ID, or None if `url` isn't a YouTube video
+    """
+    return __parse_video_id(url, allow_bare_id)
+
+
+def parse_video_ids(urls: Iterable[str], allow_bare_id: bool = True) -> list[str | None]:
+    """
+    Batch version of `parse_video_id`, for bulk imports. Not memoized: the URLs of
+    an import are mostly distinct, the cache would only ever insert and evict.
+
+    Args:
+        urls (Iterable[str]): The URLs or IDs to parse
+        allow_bare_id (bool): Whether bare 11 character IDs are accepted
+
+    Returns:
+        list[str | None]: The video ID of every URL, in the same order, None for invalid ones
+    """
+    return [__parse_video_id(url, allow_bare_id) if isinstance(url, str) else None for url in urls]
@@ -0,0 +1,619 @@
+"""
+Pipeline instrumentation
+
+A small, dependency free tracing and metrics layer used by every stage of the
+pipeline instead of `[DEBUG]` prints. It provides:
+- `span(name)`: a context manager recording wall and CPU time of a stage
+- `traced(name)`: the same as a decorator, for the `__private` stage functions
+- `runnable_span(name, runnable)`: the same around any LangChain Runnable
+- `record_usage(...)`: token counts and estimated cost of LLM / embedding calls
+- `increment_counter(...)`: plain counters (cache hits / misses and so on)
+
+Finished spans are exported as JSON lines by a background writer thread, and all
+metrics can be rendered in the Prometheus text format, either through
+`render_prometheus()` or the small HTTP endpoint started by `start_metrics_server()`.
+
+Configuration (environment):
+- TRACING_ENABLED: set to "0" to stop recording traces: spans are neither exported
+  nor linked, only the stage latency and CPU metrics are kept
+- TRACE_LOG_FILE: path of the JSON-lines log, empty to disable (default "./logs/traces.jsonl")
+- TRACE_LOG_MAX_BYTES: the log is rotated past this size, 0 to never rotate (default 50 MB)
+- TRACE_LOG_BACKUPS: the number of rotated logs kept, `<TRACE_LOG_FILE>.1` being the newest (default 5)
+- METRICS_PORT: if set, the Prometheus endpoint is started on this port on import
+- METRICS_HOST: the interface the Prometheus endpoint binds (default "127.0.0.1")
+- MODEL_PRICES_JSON: JSON object overriding the per-million-token prices,
+    `{"model-name": [input_price, output_price], ...}`
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, TypedDict
+
+# Langchain imports
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+logger = logging.getLogger("yt_summarizer")
+
+# CONFIGURATION for the instrumentation
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "./logs/traces.jsonl")
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "5"))
+METRICS_PORT: str | None = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Buckets (in seconds) for the stage latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Estimated price in USD per million (input, output) tokens
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "deepseek-ai/DeepSeek-R1-0528": (0.55, 2.19),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "intfloat/e5-mistral-7b-instruct": (0.0, 0.0),
+}
+if os.getenv("MODEL_PRICES_JSON"):
+    MODEL_PRICES.update(
+        {
+            model: (float(prices[0]), float(prices[1]))
+            for model, prices in json.loads(os.environ["MODEL_PRICES_JSON"]).items()
+        }
+    )
+
+
+class SpanRecord(TypedDict):
+    """
+    A finished span, as written to the JSON-lines log.
+
+    Attributes:
+        trace_id (str): Shared by every span of a single request.
+        span_id (str): Unique id of this span.
+        parent_id (str | None): The enclosing span, if any.
+        name (str): The stage name, e.g. "retrieve" or "generate".
+        start (float): Unix timestamp of the start of the span.
+        wall_ms (float): Elapsed wall-clock time.
+        cpu_ms (float): CPU time consumed by the current thread during the span.
+        status (str): "ok" or "error".
+        attributes (dict): Free form attributes set on the span.
+    """
+
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    name: str
+    start: float
+    wall_ms: float
+    cpu_ms: float
+    status: str
+    attributes: dict[str, Any]
+
+
+# The (trace_id, span_id) of the span that is currently open in this context
+_current_span: ContextVar[tuple[str, str] | None] = ContextVar(
+    "current_span", default=None
+)
+
+#
+# Metrics registry
+#
+
+_metrics_lock = threading.Lock()
+# (metric name, sorted label items) -> value
+_counters: dict[tuple[str, tuple], float] = {}
+# stage name -> [bucket counts..., +Inf count, sum]
+_histograms: dict[str, list[float]] = {}
+
+_METRIC_HELP = {
+    "yt_stage_duration_seconds": ("histogram", "Wall-clock time spent per pipeline stage"),
+    "yt_stage_cpu_seconds_total": ("counter", "CPU time spent per pipeline stage"),
+    "yt_stage_errors_total": ("counter", "Number of failed pipeline stages"),
+    "yt_tokens_total": ("counter", "Tokens sent to / received from model providers"),
+    "yt_cost_usd_total": ("counter", "Estimated cost of model provider calls in USD"),
+    "yt_model_calls_total": ("counter", "Number of model provider calls"),
+    "yt_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "yt_router_events_total": ("counter", "Retries, rate limits, open circuits and failovers per provider"),
+}
+
+
+def increment_counter(name: str, value: float = 1.0, **labels: str) -> None:
+    """
+    Increments a counter metric, e.g. `increment_counter("yt_cache_requests_total", cache="answers", result="hit")`
+
+    Args:
+        name (str): The metric name.
+        value (float): The amount to add.
+        **labels: The label values of the series.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """
+    Records a single cache lookup
+
+    Args:
+        cache (str): Name of the cache, e.g. "vectorstore" or "answers"
+        hit (bool): Whether the lookup was served from the cache
+    """
+    increment_counter(
+        "yt_cache_requests_total", cache=cache, result="hit" if hit else "miss"
+    )
+
+
+def __observe_stage(name: str, wall_ms: float, cpu_ms: float, status: str) -> None:
+    wall_seconds = wall_ms / 1000
+    with _metrics_lock:
+        buckets = _histograms.get(name)
+        if buckets is None:
+            buckets = _histograms[name] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if wall_seconds <= bound:
+                buckets[index] += 1
+        buckets[-2] += 1
+        buckets[-1] += wall_seconds
+
+        key = ("yt_stage_cpu_seconds_total", (("stage", name),))
+        _counters[key] = _counters.get(key, 0.0) + cpu_ms / 1000
+        if status == "error":
+            key = ("yt_stage_errors_total", (("stage", name),))
+            _counters[key] = _counters.get(key, 0.0) + 1
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int = 0) -> float:
+    """
+    Estimates the cost in USD of a model call from the price table
+
+    Args:
+        model (str): The model name, unknown models are considered free
+        input_tokens (int): Number of prompt / embedded tokens
+        output_tokens (int): Number of generated tokens
+
+    Returns:
+        float: The estimated cost in USD
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def estimate_tokens(texts: list[str]) -> int:
+    """
+    A cheap token estimate (~4 characters per token) for providers that do not
+    report usage, like the embedding endpoints
+    """
+    return sum(len(text) for text in texts) // 4 + len(texts)
+
+
+def record_usage(
+    kind: str,
+    provider: str,
+    model: str,
+    input_tokens: int,
+    output_tokens: int = 0,
+) -> None:
+    """
+    Records the token usage and estimated cost of one model call, both as metrics
+    and as attributes of the currently open span.
+
+    Args:
+        kind (str): "llm", "embedding" or "rerank"
+        provider (str): The model provider, e.g. "openai"
+        model (str): The model name
+        input_tokens (int): Number of prompt / embedded tokens
+        output_tokens (int): Number of generated tokens
+    """
+    cost = estimate_cost(model, input_tokens, output_tokens)
+    labels = dict(kind=kind, provider=provider, model=model)
+    increment_counter("yt_model_calls_total", **labels)
+    increment_counter("yt_tokens_total", input_tokens, direction="input", **labels)
+    increment_counter("yt_tokens_total", output_tokens, direction="output", **labels)
+    increment_counter("yt_cost_usd_total", cost, **labels)
+
+    # Also attach the usage to the open span
+    attributes = _current_attributes.get()
+    if attributes is not None:
+        attributes["input_tokens"] = attributes.get("input_tokens", 0) + input_tokens
+        attributes["output_tokens"] = attributes.get("output_tokens", 0) + output_tokens
+        attributes["cost_usd"] = attributes.get("cost_usd", 0.0) + cost
+        attributes["model"] = model
+
+
+def __escape_label_value(value: Any) -> str:
+    # Backslashes, double quotes and line feeds are escaped in label values
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def __format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{__escape_label_value(value)}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format
+
+    Returns:
+        str: The metrics page
+    """
+    lines: list[str] = []
+    with _metrics_lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((name, list(values)) for name, values in _histograms.items())
+
+    # Histogram of stage latencies
+    metric_type, help_text = _METRIC_HELP["yt_stage_duration_seconds"]
+    lines.append(f"# HELP yt_stage_duration_seconds {help_text}")
+    lines.append(f"# TYPE yt_stage_duration_seconds {metric_type}")
+    for stage, values in histograms:
+        for bound, count in zip(LATENCY_BUCKETS, values):
+            lines.append(
+                f'yt_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count:g}'
+            )
+        lines.append(f'yt_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {values[-2]:g}')
+        lines.append(f'yt_stage_duration_seconds_count{{stage="{stage}"}} {values[-2]:g}')
+        lines.append(f'yt_stage_duration_seconds_sum{{stage="{stage}"}} {values[-1]:.6f}')
+
+    # Every counter, grouped by name
+    last_name = None
+    for (name, labels), value in counters:
+        if name != last_name:
+            metric_type, help_text = _METRIC_HELP.get(name, ("counter", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            last_name = name
+        lines.append(f"{name}{__format_labels(labels)} {value:.6g}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics() -> None:
+    """Clears every recorded metric (used by the benchmarks between runs)"""
+    with _metrics_lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def stage_latencies() -> dict[str, tuple[int, float]]:
+    """
+    Returns:
+        dict[str, tuple[int, float]]: For every stage, its (count, total wall seconds)
+    """
+    with _metrics_lock:
+        return {name: (int(values[-2]), values[-1]) for name, values in _histograms.items()}
+
+
+#
+# Span exporters
+#
+
+# Finished spans go through this queue to the writer thread, so the request
+# thread never touches the disk
+_export_queue: "queue.SimpleQueue[SpanRecord | None]" = queue.SimpleQueue()
+_span_listeners: list[Callable[[SpanRecord], None]] = []
+_writer_thread: threading.Thread | None = None
+_writer_lock = threading.Lock()
+
+
+def add_span_listener(listener: Callable[[SpanRecord], None]) -> None:
+    """
+    Registers a function called (in the request thread) with every finished span
+
+    Args:
+        listener (Callable[[SpanRecord], None]): The function to call
+    """
+    _span_listeners.append(listener)
+
+
+def remove_span_listener(listener: Callable[[SpanRecord], None]) -> None:
+    """Unregisters a listener added through `add_span_listener`"""
+    if listener in _span_listeners:
+        _span_listeners.remove(listener)
+
+
+def __rotate_log(path: str) -> None:
+    # path -> path.1 -> path.2 ... and the oldest one is dropped
+    if TRACE_LOG_BACKUPS <= 0:
+        os.remove(path)
+        return
+    for index in range(TRACE_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def __write_spans(path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    file = open(path, mode="a", encoding="utf-8")
+    try:
+        while True:
+            record = _export_queue.get()
+            stop = record is None
+            # Batch everything that is already waiting before flushing
+            while record is not None:
+                file.write(json.dumps(record, default=str) + "\n")
+                try:
+                    record = _export_queue.get_nowait()
+                except queue.Empty:
+                    break
+                stop = record is None
+            file.flush()
+
+            if TRACE_LOG_MAX_BYTES and file.tell() >= TRACE_LOG_MAX_BYTES:
+                file.close()
+                __rotate_log(path)
+                if stop:
+                    return
+                file = open(path, mode="a", encoding="utf-8")
+            if stop:
+                return
+    finally:
+        file.close()
+
+
+def __export(record: SpanRecord) -> None:
+    global _writer_thread
+
+    for listener in _span_listeners:
+        listener(record)
+
+    if not TRACE_LOG_FILE:
+        return
+
+    # Lazily start the writer thread on the first span
+    if _writer_thread is None:
+        with _writer_lock:
+            if _writer_thread is None:
+                _writer_thread = threading.Thread(
+                    target=__write_spans,
+                    args=(TRACE_LOG_FILE,),
+                    name="trace-writer",
+                    daemon=True,
+                )
+                _writer_thread.start()
+    _export_queue.put(record)
+
+
+@atexit.register
+def flush() -> None:
+    """Writes every pending span to the log and stops the writer thread"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            return
+        _export_queue.put(None)
+        _writer_thread.join(timeout=5)
+        _writer_thread = None
+
+
+#
+# Spans
+#
+
+# The attributes of the span that is currently open in this context
+_current_attributes: ContextVar[dict[str, Any] | None] = ContextVar(
+    "current_attributes", default=None
+)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+    """
+    Records a stage of the pipeline. Spans nest, and share a trace id with the
+    outermost span of the request.
+
+    Args:
+        name (str): The stage name
+        **attributes: Attributes to attach to the span
+
+    Yields:
+        dict[str, Any]: The span attributes, which can still be updated inside the block
+
+    Example:
+        >>> with span("vector_search", k=4) as attributes:
+        >>>     chunks = store.similarity_search(query, k=4)
+        >>>     attributes["n_chunks"] = len(chunks)
+    """
+    # Without tracing, the stage is still timed for the metrics
+    tracing = TRACING_ENABLED
+    if tracing:
+        parent = _current_span.get()
+        trace_id = parent[0] if parent else uuid.uuid4().hex
+        span_id = uuid.uuid4().hex[:16]
+
+        span_token = _current_span.set((trace_id, span_id))
+        attributes_token = _current_attributes.set(attributes)
+        logger.debug("[%s] %s started", trace_id[:8], name)
+
+    status = "ok"
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield attributes
+    except BaseException as e:
+        status = "error"
+        attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        cpu_ms = (time.thread_time() - cpu_start) * 1000
+        wall_ms = (time.perf_counter() - wall_start) * 1000
+        __observe_stage(name, wall_ms, cpu_ms, status)
+
+        if tracing:
+            _current_attributes.reset(attributes_token)
+            _current_span.reset(span_token)
+
+            record = SpanRecord(
+                trace_id=trace_id,
+                span_id=span_id,
+                parent_id=parent[1] if parent else None,
+                name=name,
+                start=start,
+                wall_ms=round(wall_ms, 3),
+                cpu_ms=round(cpu_ms, 3),
+                status=status,
+                attributes=attributes,
+            )
+            logger.debug("[%s] %s finished in %.1fms (%s)", trace_id[:8], name, wall_ms, status)
+            __export(record)
+
+
+def current_trace_id() -> str | None:
+    """The trace id of the span currently open in this context, if any"""
+    current = _current_span.get()
+    return current[0] if current else None
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator running the whole function inside `span(name)`
+
+    Args:
+        name (str): The stage name
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def runnable_span(name: str, runnable: Runnable, **attributes: Any) -> Runnable:
+    """
+    Wraps a Runnable so that each of its invocations is recorded as a span
+
+    Args:
+        name (str): The stage name
+        runnable (Runnable): The runnable to wrap
+        **attributes: Attributes to attach to every span
+
+    Returns:
+        Runnable: A runnable with the same inputs and outputs
+    """
+
+    def _invoke(inputs: Any, config: RunnableConfig) -> Any:
+        with span(name, **attributes):
+            return runnable.invoke(inputs, config)
+
+    return RunnableLambda(_invoke, name=name)
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback recording the token usage of every chat model call through
+    `record_usage`. Attach it with `llm.with_config(callbacks=[usage_callback_handler])`.
+    """
+
+    def __init__(self):
+        # run_id -> (provider, model)
+        self._runs: dict[Any, tuple[str, str]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        self._runs[run_id] = (
+            metadata.get("ls_provider", "unknown"),
+            metadata.get("ls_model_name", "unknown"),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        provider, model = self._runs.pop(run_id, ("unknown", "unknown"))
+        input_tokens = output_tokens = 0
+
+        # Newer chat models report usage on the message itself
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+
+        # Otherwise fall back to the provider specific output
+        if not input_tokens and not output_tokens and response.llm_output:
+            usage = response.llm_output.get("token_usage") or {}
+            input_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+
+        record_usage("llm", provider, model, input_tokens, output_tokens)
+
+
+# Shared by every chat model of the pipeline
+usage_callback_handler = UsageCallbackHandler()
+
+
+#
+# Prometheus endpoint
+#
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't spam stderr on every scrape
+        pass
+
+
+_metrics_server: ThreadingHTTPServer | None = None
+
+
+def start_metrics_server(port: int, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+    """
+    Serves `render_prometheus()` on `http://<host>:<port>/metrics` from a daemon thread.
+    Calling it again returns the already running server.
+
+    Args:
+        port (int): The port to listen on
+        host (str): The interface to bind, only the local one by default
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    global _metrics_server
+    if _metrics_server is None:
+        _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(
+            target=_metrics_server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+    return _metrics_server
+
+
+if METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
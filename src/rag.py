@@ -31,14 +31,21 @@ load_dotenv()
 from langchain_core.runnables import RunnablePassthrough, RunnableBranch, Runnable
 
 # Then load all the modules
-from src.indexing.document_loader import runnable_load_documents
+from src.indexing.document_loader import (
+    runnable_load_documents,
+    runnable_resolve_video_id,
+)
 from src.indexing.text_splitter import (
     runnable_format_documents,
     runnable_split_embed_and_store,
 )
 from src.retrieval.retriever import runnable_retrieve_docs
+from src.retrieval.reranker import runnable_rerank_docs
 from src.augmentation.augment_query import runnable_qa_augment_prompt
 from src.generation.llm import runnable_generate
+from src.generation.answer_cache import runnable_lookup_answer, runnable_store_answer
+from src.generation.artifacts import runnable_lookup_artifact
+from src.instrumentation.tracing import record_cache, runnable_span, span
 
 
 class RetrieverChainInputs(TypedDict):
@@ -59,27 +66,32 @@ def get_retriever_chain() -> Runnable:
     Constructs and returns a LangChain Runnable representing the full retriever pipeline.
 
     The pipeline performs the following:
+    - Resolves the canonical video ID from the given URL
+    - Returns the precomputed summary, outline or key takeaways of the video if
+      that's what the query asks for (see `src/generation/artifacts.py`)
     - Attempts to retrieve relevant chunks for a video
     - If chunks are not found:
-        - Logs the missing state
+        - Records a vectorstore cache miss
         - Loads documents from the video
         - Splits, embeds, and stores them
         - Retrieves relevant chunks
-    - Formats retrieved chunks
-    - Augments the user query
-    - Generates a final response using an LLM
+    - Re-ranks the chunks with a cross-encoder, if enabled (see `src/retrieval/reranker.py`)
+    - Returns the cached answer of a similar query on the same chunks, if any
+    - Otherwise:
+        - Formats retrieved chunks
+        - Augments the user query
+        - Generates a final response using an LLM, and caches it
 
     Returns:
         Runnable: A composable LangChain pipeline to process video queries.
     """
     # The chain which will run, if the video document is not present in the database
-    runnable_fetch_docs_if_not_exists = (
-        RunnablePassthrough(
-            lambda inputs: print(f"[DEBUG]: Video '{inputs['video_url']}' not found in database")
-        )
+    runnable_fetch_docs_if_not_exists = runnable_span(
+        "ingest",
+        RunnablePassthrough(lambda _: record_cache("vectorstore", hit=False))
         | runnable_load_documents
         | runnable_split_embed_and_store
-        | runnable_retrieve_docs
+        | runnable_retrieve_docs,
     )
 
     # The chain which runs when we're given chunks and query
@@ -87,13 +99,19 @@ def get_retriever_chain() -> Runnable:
         runnable_format_documents | runnable_qa_augment_prompt | runnable_generate
     )
 
+    # Generates the answer, and stores it in the answer cache
+    runnable_generate_and_cache = (
+        RunnablePassthrough.assign(answer=runnable_format_chunks_and_generate)
+        | runnable_store_answer
+    )
+
     # If we have the chunks, then this chain will run
     runnable_chunks_found = RunnablePassthrough(
-        lambda _: print("[DEBUG]: Found chunks for the video")
+        lambda _: record_cache("vectorstore", hit=True)
     )
 
-    # This is our main chain now (with all the workflow)
-    return (
+    # The retrieval augmented generation of the answer
+    runnable_retrieve_and_generate = (
         runnable_retrieve_docs
         | RunnableBranch(
             (
@@ -102,7 +120,28 @@ def get_retriever_chain() -> Runnable:
             ),
             runnable_chunks_found,
         )
-        | runnable_format_chunks_and_generate
+        | runnable_rerank_docs
+        | runnable_lookup_answer
+        | RunnableBranch(
+            (
+                lambda inputs: inputs["cached_answer"] is not None,
+                lambda inputs: inputs["cached_answer"],
+            ),
+            runnable_generate_and_cache,
+        )
+    )
+
+    # This is our main chain now (with all the workflow)
+    return (
+        runnable_resolve_video_id
+        | runnable_lookup_artifact
+        | RunnableBranch(
+            (
+                lambda inputs: inputs["artifact"] is not None,
+                lambda inputs: inputs["artifact"],
+            ),
+            runnable_retrieve_and_generate,
+        )
     )
 
 
@@ -122,7 +161,8 @@ def get_summary_results(inputs: RetrieverChainInputs) -> tuple[bool, str]:
     retriever_chain = get_retriever_chain()
     # Return the documents
     try:
-        response = retriever_chain.invoke(inputs)
+        with span("pipeline", video_url=inputs["video_url"]):
+            response = retriever_chain.invoke(inputs)
         return True, response
     except Exception as e:
         print("[ERROR]: " + str(e))
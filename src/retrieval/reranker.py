@@ -0,0 +1,123 @@
+"""
+Cross-encoder re-ranking of the retrieved chunks
+
+Vector similarity alone ranks the best passage of noisy auto-captions far too low
+too often. When enabled, the retriever over-fetches `RERANK_FETCH_K` candidates,
+a small local cross-encoder scores every (query, chunk) pair, and only the
+`RERANK_TOP_N` best chunks go into the prompt: a smaller and more precise context
+for the LLM.
+
+The model runs on the CPU, is loaded once per process on first use, and scores the
+candidates in batches. If it can't be loaded (e.g. `sentence-transformers` is not
+installed), the chunks keep their vector similarity order.
+
+Configuration (environment):
+- RERANK_ENABLED: set to "1" to re-rank the retrieved chunks
+- RERANK_MODEL: the cross-encoder (default "cross-encoder/ms-marco-MiniLM-L-6-v2")
+- RERANK_FETCH_K: the number of candidates retrieved (default 30)
+- RERANK_TOP_N: the number of chunks kept for the prompt (default 4)
+- RERANK_BATCH_SIZE: the (query, chunk) pairs scored at once (default 16)
+"""
+
+import os
+import threading
+from typing import TypedDict
+
+# Langchain imports
+from langchain_core.runnables import RunnableLambda
+from langchain.schema import Document
+
+# Custom imports
+from src.instrumentation.tracing import estimate_tokens, logger, record_usage, span, traced
+
+# CONFIGURATION for the re-ranking
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "30"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+
+_cross_encoder = None
+_cross_encoder_error: Exception | None = None
+_cross_encoder_lock = threading.Lock()
+
+
+def get_cross_encoder():
+    """
+    The cross-encoder, loaded once per process (and shared by every thread)
+
+    Returns:
+        CrossEncoder | None: The model, None if it couldn't be loaded
+    """
+    global _cross_encoder, _cross_encoder_error
+    if _cross_encoder is not None or _cross_encoder_error is not None:
+        return _cross_encoder
+
+    with _cross_encoder_lock:
+        if _cross_encoder is None and _cross_encoder_error is None:
+            try:
+                from sentence_transformers import CrossEncoder
+
+                with span("rerank_model_load", model=RERANK_MODEL):
+                    _cross_encoder = CrossEncoder(RERANK_MODEL, device="cpu")
+            except Exception as e:
+                # Don't try again on every request
+                _cross_encoder_error = e
+                logger.warning("Re-ranking disabled, couldn't load '%s': %s", RERANK_MODEL, e)
+    return _cross_encoder
+
+
+def rerank(query: str, chunks: list[Document], top_n: int = RERANK_TOP_N) -> list[Document]:
+    """
+    Args:
+        query: The user's query
+        chunks: The candidate chunks
+        top_n: The number of chunks to keep
+
+    Returns:
+        list[Document]: The `top_n` most relevant chunks, best first (the first
+            `top_n` candidates if the model is unavailable)
+    """
+    model = get_cross_encoder() if len(chunks) > 1 else None
+    if model is None:
+        return chunks[:top_n]
+
+    texts = [chunk.page_content for chunk in chunks]
+    scores = model.predict(
+        [(query, text) for text in texts],
+        batch_size=RERANK_BATCH_SIZE,
+        show_progress_bar=False,
+    )
+    record_usage("rerank", "local", RERANK_MODEL, estimate_tokens([query] * len(texts) + texts))
+
+    # Stable, so ties keep their vector similarity order
+    order = sorted(range(len(chunks)), key=lambda index: -float(scores[index]))
+    return [chunks[index] for index in order[:top_n]]
+
+
+class RerankInputs(TypedDict):
+    chunks: list[Document]
+    query: str
+
+
+class RerankOutputs(TypedDict):
+    chunks: list[Document]
+    query: str
+
+
+@traced("rerank")
+def __rerank_docs(inputs: RerankInputs) -> RerankOutputs:
+    """
+    Keeps the most relevant of the retrieved chunks, if re-ranking is enabled
+    Args:
+        inputs: { chunks: list[Document], query: str }
+    Returns:
+        outputs: { chunks: list[Document], query: str }
+    """
+    if RERANK_ENABLED:
+        inputs["chunks"] = rerank(inputs["query"], inputs["chunks"])
+    return inputs
+
+
+# The main export from this module
+runnable_rerank_docs = RunnableLambda(__rerank_docs)
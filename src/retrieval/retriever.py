@@ -7,43 +7,57 @@ from langchain.schema import Document
 # Custom imports
 from src.indexing.vectorstore import get_vector_store
 from src.indexing.document_loader import YouTubeTranscriptsLoader
+from src.retrieval.reranker import RERANK_ENABLED, RERANK_FETCH_K
+from src.instrumentation.tracing import span, traced
 
 
 class RetrievalInputs(TypedDict):
     query: str
     video_url: str
+    video_id: str
 
 
 class RetrievalOutputs(TypedDict):
     chunks: list[Document]
     query: str
+    query_embedding: list[float]
     video_url: str
+    video_id: str
 
 
+@traced("retrieve")
 def __retrieve_docs(inputs: RetrievalInputs) -> RetrievalOutputs:
     """
     Retrieves the documents for given input
     Args:
-        inputs: { query: str, video_url: str }
+        inputs: { query: str, video_url: str, video_id: str }
 
     Returns:
-        outputs: { chunks: list[Document], query: str, video_url: str}
+        outputs: { chunks: list[Document], query: str, query_embedding: list[float], video_url: str, video_id: str }
     """
-    print(f"[DEBUG]: Retrieving documents for video='{inputs['video_url']}'")
-    # Get the video_id
-    video_id = YouTubeTranscriptsLoader.get_video_id(inputs["video_url"])
+    # Get the video_id (resolved once at the entry of the pipeline)
+    video_id = inputs.get("video_id")
+    if not video_id:
+        video_id = inputs["video_id"] = YouTubeTranscriptsLoader.get_video_id(inputs["video_url"])
 
-    # Configure the retriever
-    retriever_kwargs = dict(
-        search_type="similarity",
-        search_kwargs={"k": 4, "filter": {"video_id": video_id}},
-    )
-    # Get the retriever
-    retriever = get_vector_store().as_retriever(**retriever_kwargs)
+    # Configure the search (over-fetch the candidates of the re-ranker)
+    search_kwargs = {
+        "k": RERANK_FETCH_K if RERANK_ENABLED else 4,
+        "filter": {"video_id": video_id},
+    }
+    # Get the store
+    vectorstore = get_vector_store()
+
+    # Embed the query only once per request, the embedding is also reused by the answer cache
+    if inputs.get("query_embedding") is None:
+        inputs["query_embedding"] = vectorstore.embeddings.embed_query(inputs["query"])
 
     try:
         # Append matching chunks to the output
-        inputs["chunks"] = retriever.invoke(inputs["query"])
+        with span("vector_search", video_id=video_id):
+            inputs["chunks"] = vectorstore.similarity_search_by_vector(
+                inputs["query_embedding"], **search_kwargs
+            )
     except Exception as e:
         # Check if the exception is result of an unexpected vector size
         if not str(e).startswith(
@@ -51,11 +65,12 @@ def __retrieve_docs(inputs: RetrievalInputs) -> RetrievalOutputs:
         ) or "got" not in str(e):
             raise e
         # We're dealing with a shift in embedding vector type, clear the store and reset the db
-        get_vector_store().delete_collection()
-        # Initialize a new store, and a retriever
-        retriever = get_vector_store().as_retriever(**retriever_kwargs)
+        vectorstore.reset_collection()
         # Append matching chunks to the output
-        inputs["chunks"] = retriever.invoke(inputs["query"])
+        with span("vector_search", video_id=video_id):
+            inputs["chunks"] = vectorstore.similarity_search_by_vector(
+                inputs["query_embedding"], **search_kwargs
+            )
     
     # Return the inputs, converted to output
     return inputs
@@ -0,0 +1,161 @@
+"""
+Background summary jobs shared by every session of the web UI
+
+The Streamlit script must not block for the whole pipeline, and concurrent users
+asking about the same video shouldn't multiply the backend work. `SummaryJobManager`:
+- runs `get_summary_results` on a shared thread pool, and returns a `SummaryJob` right away
+- reports the stages completed by every job, from the spans of its trace
+- deduplicates in-flight requests for the same (video_id, query)
+- keeps the successful results in a cache shared across sessions, for `SUMMARY_CACHE_TTL_SECONDS`
+
+Configuration (environment):
+- SUMMARY_WORKERS: the number of pipelines running concurrently (default 4)
+- SUMMARY_CACHE_TTL_SECONDS: how long a result is served from the cache (default 3600)
+- SUMMARY_CACHE_MAX_ENTRIES: the number of results kept in the cache (default 1024)
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Custom imports
+from src.rag import RetrieverChainInputs, get_summary_results
+from src.indexing.document_loader import YouTubeTranscriptsLoader
+from src.instrumentation import tracing
+
+# CONFIGURATION for the jobs
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+SUMMARY_CACHE_TTL_SECONDS = float(os.getenv("SUMMARY_CACHE_TTL_SECONDS", "3600"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "1024"))
+
+
+class SummaryJob:
+    """
+    A request running (or already run) in the background
+
+    Attributes:
+        key (tuple[str, str]): The (video_id, normalized query) of the request
+        future (Future): Resolves to the (success, response) of `get_summary_results`
+        stages (list[tuple[str, float]]): The (stage, milliseconds) completed so far
+        started_at (float): When the job was submitted
+        cached (bool): Whether the result came from the cache
+    """
+
+    def __init__(self, key: tuple[str, str], future: Future | None = None, cached: bool = False):
+        self.key = key
+        self.future: Future = future or Future()
+        self.stages: list[tuple[str, float]] = []
+        self.started_at = time.monotonic()
+        self.cached = cached
+        self.trace_id: str | None = None
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self) -> tuple[bool, str]:
+        return self.future.result()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class SummaryJobManager:
+    """
+    Runs the pipeline in the background for every session of the web UI
+
+    Example:
+        >>> manager = SummaryJobManager()
+        >>> job = manager.submit("https://www.youtube.com/watch?v=4g-fPNjizrw", "")
+        >>> success, response = job.result()
+    """
+
+    def __init__(
+        self,
+        max_workers: int = SUMMARY_WORKERS,
+        ttl_seconds: float = SUMMARY_CACHE_TTL_SECONDS,
+        max_entries: int = SUMMARY_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summary")
+        self._lock = threading.Lock()
+        # key -> job, while it is running
+        self._running: dict[tuple[str, str], SummaryJob] = {}
+        # trace_id -> job, to follow the progress
+        self._traces: dict[str, SummaryJob] = {}
+        # key -> (expires at, response)
+        self._results: OrderedDict[tuple[str, str], tuple[float, str]] = OrderedDict()
+        tracing.add_span_listener(self.__on_span)
+
+    @staticmethod
+    def get_key(video_url: str, query: str) -> tuple[str, str]:
+        """The cache key of a request: (video_id, query without case nor extra spaces)"""
+        video_id = YouTubeTranscriptsLoader.get_video_id(video_url)
+        return video_id, " ".join((query or "").lower().split())
+
+    def __on_span(self, record: tracing.SpanRecord) -> None:
+        job = self._traces.get(record["trace_id"])
+        if job is not None and record["name"] != "summary_job":
+            job.stages.append((record["name"], record["wall_ms"]))
+
+    def __run(self, job: SummaryJob, inputs: RetrieverChainInputs) -> tuple[bool, str]:
+        success, response = False, ""
+        try:
+            with tracing.span("summary_job", video_id=job.key[0]):
+                job.trace_id = tracing.current_trace_id()
+                if job.trace_id is not None:
+                    self._traces[job.trace_id] = job
+                success, response = get_summary_results(inputs)
+        finally:
+            self._traces.pop(job.trace_id, None)
+            with self._lock:
+                self._running.pop(job.key, None)
+                # Errors aren't cached, so the next request tries again
+                if success:
+                    self._results[job.key] = (time.monotonic() + self.ttl_seconds, response)
+                    self._results.move_to_end(job.key)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+        return success, response
+
+    def submit(self, video_url: str, query: str) -> SummaryJob:
+        """
+        Starts the pipeline for the given request in the background, unless its
+        result is cached or the same request is already running.
+
+        Args:
+            video_url: The YouTube video URL or ID
+            query: The user's query
+
+        Returns:
+            SummaryJob: The (maybe already completed) job
+
+        Raises:
+            ValueError: If the URL is not a valid YouTube video URL
+        """
+        key = self.get_key(video_url, query)
+        with self._lock:
+            # Served from the cache
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._results.move_to_end(key)
+                tracing.record_cache("summaries", hit=True)
+                job = SummaryJob(key, cached=True)
+                job.future.set_result((True, cached[1]))
+                return job
+
+            # Already running for another session
+            job = self._running.get(key)
+            if job is not None:
+                tracing.record_cache("summaries", hit=True)
+                return job
+
+            tracing.record_cache("summaries", hit=False)
+            job = self._running[key] = SummaryJob(key)
+            job.future = self._executor.submit(
+                self.__run, job, {"query": query, "video_url": video_url}
+            )
+            return job
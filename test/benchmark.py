@@ -0,0 +1,501 @@
+"""
+Offline benchmark of the whole retriever pipeline
+
+Replaces the network facing parts of the pipeline with deterministic local fakes
+with configurable latency:
+- `YouTubeTranscriptApi` returns a synthetic transcript of the requested size
+- the embedding function returns hash seeded random unit vectors
+- the `llm` returns a fixed answer with a fake token usage
+
+Synthetic transcripts (1k to 500k characters by default) are then run through
+`get_retriever_chain()`, once cold (fetch, split, embed and store) and several
+times warm (retrieval and generation only). The per-stage spans recorded by
+`src/instrumentation/tracing.py` give the latency percentiles and throughput of
+every stage.
+
+Usage:
+    python test/benchmark.py                    # run, and compare with the baseline
+    python test/benchmark.py --save-baseline    # run, and store the result as the new baseline
+    python test/benchmark.py --sizes 1000 50000 --warm-runs 20
+    python test/benchmark.py --vector-store-mode binary
+    python test/benchmark.py --quantization-report
+
+The exit code is 1 if any stage regressed against the stored baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import tempfile
+from typing import Any
+
+# Never reach the network, nor write the trace log, whatever is in `.env`
+os.environ["GOOGLE_API_KEY"] = ""
+os.environ["HUGGINGFACEHUB_API_TOKEN"] = ""
+os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+os.environ["TRACE_LOG_FILE"] = ""
+# Warm runs repeat the same query, keep measuring generation unless asked otherwise
+os.environ["SEMANTIC_CACHE_ENABLED"] = "1" if "--answer-cache" in sys.argv else "0"
+
+# Make `src` importable when running `python test/benchmark.py`
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import src.generation.llm as llm_module
+import src.indexing.document_loader as document_loader_module
+import src.indexing.vectorstore as vectorstore_module
+from src.indexing import quantization
+from src.indexing.compact_store import COMPACT_RERANK_CANDIDATES, CompactIndex
+from src.indexing.text_splitter import CHUNK_OVERLAP, CHUNK_SIZE, RecursiveCharacterTextSplitter
+from src.instrumentation import tracing
+from src.rag import get_retriever_chain
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 500_000]
+
+# Vocabulary for the synthetic transcripts
+WORDS = (
+    "the a of to and in that is for it on you this with we be are so was have not "
+    "video model data language learn train network layer token vector search query "
+    "summary chapter speaker topic example result python chain prompt memory store "
+    "retrieval embedding transcript caption answer question context performance"
+).split()
+
+
+#
+# The local fakes
+#
+
+
+class FakeTranscriptApi:
+    """Stands in for `YouTubeTranscriptApi`, with `transcript_chars` characters per video"""
+
+    transcript_chars = 1_000
+    latency_ms = 0.0
+
+    @classmethod
+    def get_transcript(cls, video_id: str, languages: list[str]) -> list[dict[str, Any]]:
+        time.sleep(cls.latency_ms / 1000)
+        rng = random.Random(zlib.crc32(video_id.encode()))
+
+        segments, length, start = [], 0, 0.0
+        while length < cls.transcript_chars:
+            text = " ".join(rng.choices(WORDS, k=rng.randint(6, 14)))
+            duration = round(len(text) / 15, 2)
+            segments.append({"text": text, "start": start, "duration": duration})
+            length += len(text) + 1
+            start = round(start + duration, 2)
+        return segments
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors seeded by the hash of the text"""
+
+    def __init__(self, dimensions: int, latency_ms: float):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+
+    def __embed(self, text: str) -> list[float]:
+        rng = np.random.default_rng(zlib.crc32(text.encode()))
+        vector = rng.standard_normal(self.dimensions, dtype=np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency_ms / 1000)
+        return [self.__embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency_ms / 1000)
+        return self.__embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers every prompt with a fixed text after `latency_ms`"""
+
+    latency_ms: float = 0.0
+    answer: str = "This is a benchmark answer. " * 20
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        output_tokens = len(self.answer) // 4
+        message = AIMessage(
+            content=self.answer,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def install_fakes(args: argparse.Namespace, persist_directory: str) -> None:
+    """Swaps the network facing parts of the pipeline for the local fakes"""
+    FakeTranscriptApi.latency_ms = args.transcript_latency_ms
+    document_loader_module.YouTubeTranscriptApi = FakeTranscriptApi
+
+    embeddings = vectorstore_module.InstrumentedEmbeddings(
+        FakeEmbeddings(args.embedding_dimensions, args.embedding_latency_ms),
+        "fake",
+        "fake-embeddings",
+    )
+    vectorstore_module.get_embedding_function = lambda: embeddings
+    vectorstore_module.PERSIST_DIRECTORY = persist_directory
+    vectorstore_module.VECTOR_STORE_MODE = args.vector_store_mode
+
+    llm_module.llm = FakeChatModel(latency_ms=args.llm_latency_ms).with_config(
+        callbacks=[tracing.usage_callback_handler]
+    )
+
+
+#
+# Measurements
+#
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of `values`"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(durations: dict[str, list[float]]) -> dict[str, dict[str, float]]:
+    """
+    Args:
+        durations (dict[str, list[float]]): The wall times (ms) of every span per stage
+    Returns:
+        dict: {stage: {calls, p50_ms, p95_ms, throughput_per_s}}
+    """
+    stages = {}
+    for name, values in sorted(durations.items()):
+        total_seconds = sum(values) / 1000
+        stages[name] = {
+            "calls": len(values),
+            "p50_ms": round(percentile(values, 0.50), 3),
+            "p95_ms": round(percentile(values, 0.95), 3),
+            "throughput_per_s": round(len(values) / total_seconds, 2) if total_seconds else 0.0,
+        }
+    return stages
+
+
+def run_size(chain, size: int, args: argparse.Namespace) -> dict[str, Any]:
+    """Benchmarks the pipeline for transcripts of `size` characters"""
+    FakeTranscriptApi.transcript_chars = size
+
+    cold: dict[str, list[float]] = {}
+    warm: dict[str, list[float]] = {}
+    current = cold
+
+    def listener(record: tracing.SpanRecord) -> None:
+        current.setdefault(record["name"], []).append(record["wall_ms"])
+
+    tracing.add_span_listener(listener)
+    ingest_seconds = 0.0
+    try:
+        for run in range(args.cold_runs):
+            # A fresh (valid, 11 characters) video id for every cold run
+            video_id = f"b{size:07d}{run:03d}"
+            inputs = {"query": args.query, "video_url": f"https://www.youtube.com/watch?v={video_id}"}
+
+            current = cold
+            start = time.perf_counter()
+            with tracing.span("pipeline"):
+                chain.invoke(dict(inputs))
+            ingest_seconds += time.perf_counter() - start
+
+            current = warm
+            for _ in range(args.warm_runs):
+                with tracing.span("pipeline"):
+                    chain.invoke(dict(inputs))
+    finally:
+        tracing.remove_span_listener(listener)
+
+    return {
+        "transcript_chars": size,
+        "ingest_chars_per_s": round(size * args.cold_runs / ingest_seconds, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "cold": summarize(cold),
+        "warm": summarize(warm),
+    }
+
+
+#
+# Reporting
+#
+
+
+def print_report(results: list[dict[str, Any]]) -> None:
+    for result in results:
+        print(
+            f"\n=== {result['transcript_chars']:,} characters "
+            f"(ingest {result['ingest_chars_per_s']:,.0f} chars/s, peak RSS {result['peak_rss_mb']} MB)"
+        )
+        print(f"{'path':<6} {'stage':<24} {'calls':>6} {'p50 ms':>10} {'p95 ms':>10} {'ops/s':>10}")
+        for path in ("cold", "warm"):
+            for stage, stats in result[path].items():
+                print(
+                    f"{path:<6} {stage:<24} {stats['calls']:>6} {stats['p50_ms']:>10.2f} "
+                    f"{stats['p95_ms']:>10.2f} {stats['throughput_per_s']:>10.1f}"
+                )
+
+
+def compare_with_baseline(
+    results: list[dict[str, Any]], baseline: dict[str, Any], args: argparse.Namespace
+) -> list[str]:
+    """
+    Returns:
+        list[str]: One line per stage whose p50 or p95 got slower than
+            `baseline * tolerance + slack`
+    """
+    regressions = []
+    baseline_by_size = {result["transcript_chars"]: result for result in baseline["results"]}
+
+    for result in results:
+        previous = baseline_by_size.get(result["transcript_chars"])
+        if previous is None:
+            continue
+        for path in ("cold", "warm"):
+            for stage, stats in result[path].items():
+                old = previous[path].get(stage)
+                if old is None:
+                    continue
+                for metric in ("p50_ms", "p95_ms"):
+                    limit = old[metric] * args.tolerance + args.slack_ms
+                    if stats[metric] > limit:
+                        regressions.append(
+                            f"{result['transcript_chars']:>9,} {path:<5} {stage:<24} {metric}: "
+                            f"{old[metric]:.2f} -> {stats[metric]:.2f} ms"
+                        )
+    return regressions
+
+
+#
+# Quantization report
+#
+
+
+def synthetic_corpus(args: argparse.Namespace) -> tuple[list[np.ndarray], list[tuple[int, np.ndarray]]]:
+    """
+    The chunks of the benchmark transcripts, embedded as synthetic vectors
+
+    Real embeddings concentrate their variance in the first dimensions (and
+    Matryoshka models are trained for it), so the vectors are drawn with a decaying
+    per-dimension spectrum. The queries are noisy copies of random chunks.
+
+    Returns:
+        (videos, queries): the (n, d) unit float32 vectors of every video, and the
+            (video, unit query vector) of every query
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    rng = np.random.default_rng(0)
+    spectrum = 1 / np.sqrt(1 + np.arange(args.embedding_dimensions, dtype=np.float32) / 64)
+
+    def draw(count: int) -> np.ndarray:
+        vectors = rng.standard_normal((count, args.embedding_dimensions), dtype=np.float32)
+        return quantization.normalize(vectors * spectrum)
+
+    videos = []
+    for video in range(args.report_videos):
+        FakeTranscriptApi.transcript_chars = args.sizes[video % len(args.sizes)]
+        segments = FakeTranscriptApi.get_transcript(f"report{video:06d}", ["en"])
+        chunks = splitter.split_text(" ".join(segment["text"] for segment in segments))
+        videos.append(draw(len(chunks)))
+
+    queries = []
+    for video in rng.integers(0, len(videos), args.report_queries):
+        document = videos[video][rng.integers(0, len(videos[video]))]
+        queries.append((int(video), quantization.normalize(document + args.query_noise * draw(1)[0])))
+    return videos, queries
+
+
+def quantization_report(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """
+    Recall@k against the exact float32 search, storage and query latency of every
+    compression of the synthetic corpus. Like the pipeline, every query only
+    searches the chunks of its own video, and the compact indexes are saved and
+    loaded back (so the binary re-scoring reads its memory mapped copy).
+
+    The recall only counts the queries on videos with more chunks than
+    `COMPACT_RERANK_CANDIDATES`: below, the binary coarse search keeps every chunk.
+    """
+    videos, queries = synthetic_corpus(args)
+    k = args.report_k
+    measured = [(video, query) for video, query in queries if len(videos[video]) > COMPACT_RERANK_CANDIDATES]
+    if not measured:
+        print(f"[WARNING]: no video has more than {COMPACT_RERANK_CANDIDATES} chunks, the binary recall is exact")
+        measured = queries
+    queries = measured
+    exact = [set(quantization.top_k(videos[video] @ query, k).tolist()) for video, query in queries]
+
+    dimensions = args.embedding_dimensions
+    configurations = [("float32", dimensions), ("int8", dimensions), ("binary", dimensions)]
+    for truncated in (dimensions // 2, dimensions // 4):
+        configurations += [("float32", truncated), ("int8", truncated), ("binary", truncated)]
+
+    rows = []
+    directory = tempfile.TemporaryDirectory(prefix="yt-quantization-")
+    for mode, truncated in configurations:
+        vectors = [quantization.truncate(documents, truncated) for documents in videos]
+        if mode == "float32":
+            nbytes, disk_nbytes = sum(documents.nbytes for documents in vectors), 0
+            search = lambda video, query: quantization.top_k(vectors[video] @ query, k)
+        else:
+            indexes = []
+            for video, documents in enumerate(vectors):
+                count = len(documents)
+                index = CompactIndex(mode, truncated)
+                index.add([str(i) for i in range(count)], documents, [""] * count, [{}] * count)
+                path = os.path.join(directory.name, f"{mode}-{truncated}-{video}")
+                index.save(path)
+                indexes.append(CompactIndex.load(path))
+            nbytes = sum(index.nbytes for index in indexes)
+            disk_nbytes = sum(index.rescore_nbytes for index in indexes)
+            search = lambda video, query: [position for position, _ in indexes[video].search(query, k)]
+
+        found, started = 0, time.perf_counter()
+        for (video, query), expected in zip(queries, exact):
+            found += len(expected.intersection(search(video, quantization.truncate(query, truncated))))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        rows.append({
+            "mode": mode,
+            "dimensions": truncated,
+            "bytes_per_vector": nbytes / sum(len(documents) for documents in vectors),
+            "rescore_bytes_per_vector": disk_nbytes / sum(len(documents) for documents in vectors),
+            "recall": found / sum(len(expected) for expected in exact),
+            "query_ms": elapsed_ms / len(queries),
+        })
+
+    directory.cleanup()
+
+    chunks = sum(len(documents) for documents in videos)
+    print(f"\n{chunks:,} chunks of {len(videos)} synthetic transcripts, {len(queries)} queries")
+    print(f"on the videos with more than {COMPACT_RERANK_CANDIDATES} chunks")
+    print("[NOTE]: the vectors are synthetic, check the recall on real embeddings before relying on it\n")
+    print("bytes/vector is kept in memory, the binary modes also keep an int8 copy on disk")
+    print(f"(memory mapped) to re-score their {COMPACT_RERANK_CANDIDATES} best candidates. The ratio counts both.\n")
+    print(
+        f"{'mode':<8} {'dims':>6} {'bytes/vector':>13} {'ratio':>7} {'on disk':>8} "
+        f"{f'recall@{k}':>10} {'query ms':>9}"
+    )
+    full_size = rows[0]["bytes_per_vector"]
+    for row in rows:
+        print(
+            f"{row['mode']:<8} {row['dimensions']:>6} {row['bytes_per_vector']:>13,.0f} "
+            f"{full_size / (row['bytes_per_vector'] + row['rescore_bytes_per_vector']):>6.1f}x "
+            f"{row['rescore_bytes_per_vector']:>8,.0f} "
+            f"{row['recall']:>10.3f} {row['query_ms']:>9.3f}"
+        )
+    return rows
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Transcript sizes in characters")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Videos ingested per size")
+    parser.add_argument("--warm-runs", type=int, default=10, help="Queries per ingested video")
+    parser.add_argument("--query", default="Summarize the video")
+    parser.add_argument("--transcript-latency-ms", type=float, default=20.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=2.0)
+    parser.add_argument("--embedding-dimensions", type=int, default=1024)
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--answer-cache", action="store_true", help="Serve warm runs from the semantic answer cache")
+    parser.add_argument("--vector-store-mode", default="chroma", choices=["chroma", "int8", "binary"])
+    parser.add_argument("--quantization-report", action="store_true", help="Only report the recall, size and speed of the compressed vectors")
+    parser.add_argument("--report-videos", type=int, default=40, help="Transcripts embedded for the quantization report")
+    parser.add_argument("--report-queries", type=int, default=200)
+    parser.add_argument("--report-k", type=int, default=4)
+    parser.add_argument("--query-noise", type=float, default=0.5, help="Relative noise of the report queries")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed slowdown factor")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="Allowed absolute slowdown")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.quantization_report:
+        rows = quantization_report(args)
+        if args.output:
+            with open(args.output, mode="w", encoding="utf-8") as file:
+                json.dump(rows, file, indent=2)
+        return 0
+
+    config = {
+        key: getattr(args, key)
+        for key in (
+            "cold_runs", "warm_runs", "query", "transcript_latency_ms",
+            "embedding_latency_ms", "embedding_dimensions", "llm_latency_ms",
+            "vector_store_mode",
+        )
+    }
+
+    with tempfile.TemporaryDirectory(prefix="yt-benchmark-") as persist_directory:
+        install_fakes(args, persist_directory)
+        chain = get_retriever_chain()
+        results = [run_size(chain, size, args) for size in args.sizes]
+
+    print_report(results)
+    report = {"config": config, "results": results}
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, mode="w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nBaseline written to: {args.baseline}")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("\nNo baseline to compare with, run with `--save-baseline` to create one")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline["config"] != config:
+        print("\n[WARNING]: The baseline was recorded with a different configuration")
+
+    regressions = compare_with_baseline(results, baseline, args)
+    if not regressions:
+        print("\nNo regressions against the baseline")
+        return 0
+
+    print(f"\n{len(regressions)} regression(s) against the baseline:")
+    for line in regressions:
+        print("  " + line)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""
+Shared setup of the test suite: `src` is importable however pytest is started, and
+the tests never write the trace log nor reach the network
+"""
+
+import os
+import sys
+
+os.environ["TRACE_LOG_FILE"] = ""
+os.environ["GOOGLE_API_KEY"] = ""
+os.environ["HUGGINGFACEHUB_API_TOKEN"] = ""
+os.environ["OPENAI_API_KEY"] = "sk-test"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
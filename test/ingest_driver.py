@@ -0,0 +1,93 @@
+"""
+Runs `ingest_videos` with the local fakes of the benchmark, for `test_parallel_ingest.py`
+
+The worker processes are spawned, and import this script again (as `__mp_main__`):
+the fakes are installed at import, so they replace the transcript API and the
+embeddings in the workers too. Configured through the environment, which the
+workers inherit:
+- INGEST_TEST_DIRECTORY: the persist directory of the store
+- INGEST_TEST_MODE: the vector store mode (default "chroma")
+- INGEST_TEST_DIMENSIONS: the dimensions of the fake embeddings (default 16)
+- INGEST_TEST_FAILING: comma separated videos without captions
+- INGEST_TEST_CRASHING: comma separated videos crashing the writer once stored
+
+Usage:
+    python test/ingest_driver.py [--force] <video URLs or IDs>...
+
+Prints the report as JSON, with the shared memory blocks left behind.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# Installs the fakes, and makes `src` importable
+from benchmark import FakeTranscriptApi, install_fakes
+
+from youtube_transcript_api import TranscriptsDisabled
+
+import src.indexing.document_loader as document_loader_module
+import src.indexing.parallel_ingest as parallel_ingest
+import src.indexing.vectorstore as vectorstore_module
+
+FAILING = set(filter(None, os.getenv("INGEST_TEST_FAILING", "").split(",")))
+CRASHING = set(filter(None, os.getenv("INGEST_TEST_CRASHING", "").split(",")))
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+
+class FailingTranscriptApi(FakeTranscriptApi):
+    """No captions for the `INGEST_TEST_FAILING` videos"""
+
+    @classmethod
+    def get_transcript(cls, video_id: str, languages: list[str]):
+        if video_id in FAILING:
+            raise TranscriptsDisabled(video_id)
+        return super().get_transcript(video_id, languages)
+
+
+def crash_on_enqueue(video_id: str, transcript: str, timestamps=None) -> None:
+    if video_id in CRASHING:
+        raise RuntimeError(f"Crashed after storing '{video_id}'")
+
+
+install_fakes(
+    argparse.Namespace(
+        transcript_latency_ms=0.0,
+        embedding_dimensions=int(os.getenv("INGEST_TEST_DIMENSIONS", "16")),
+        embedding_latency_ms=0.0,
+        vector_store_mode=os.getenv("INGEST_TEST_MODE", "chroma"),
+        llm_latency_ms=0.0,
+    ),
+    os.getenv("INGEST_TEST_DIRECTORY", "./db"),
+)
+document_loader_module.YouTubeTranscriptApi = FailingTranscriptApi
+embeddings = vectorstore_module.get_embedding_function()
+parallel_ingest.get_embedding_function = lambda local_threads=None: embeddings
+parallel_ingest.enqueue_artifacts = crash_on_enqueue
+
+
+def shared_memory_blocks() -> set[str]:
+    if not os.path.isdir(SHARED_MEMORY_DIRECTORY):
+        return set()
+    return {name for name in os.listdir(SHARED_MEMORY_DIRECTORY) if name.startswith("psm_")}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("video_urls", nargs="+")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    before = shared_memory_blocks()
+    try:
+        output = parallel_ingest.ingest_videos(args.video_urls, workers=2, skip_existing=not args.force)
+    except Exception as e:
+        output = {"error": str(e)}
+    output["leaked"] = sorted(shared_memory_blocks() - before)
+    print(json.dumps(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
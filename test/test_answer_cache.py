@@ -0,0 +1,78 @@
+import numpy as np
+from langchain.schema import Document
+
+from src.generation.answer_cache import SemanticAnswerCache, get_chunk_ids
+
+
+def unit(*values: float) -> list[float]:
+    vector = np.asarray(values, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def test_similar_query_on_the_same_chunks_hits():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("video", unit(1, 0, 0), ["a", "b"], "answer")
+    assert cache.lookup("video", unit(1, 0.1, 0), ["b", "a"]) == "answer"
+
+
+def test_dissimilar_query_misses():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("video", unit(1, 0, 0), ["a", "b"], "answer")
+    assert cache.lookup("video", unit(0, 1, 0), ["a", "b"]) is None
+
+
+def test_other_chunks_or_video_miss():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("video", unit(1, 0, 0), ["a", "b"], "answer")
+    assert cache.lookup("video", unit(1, 0, 0), ["a", "c"]) is None
+    assert cache.lookup("other", unit(1, 0, 0), ["a", "b"]) is None
+
+
+def test_best_match_wins():
+    cache = SemanticAnswerCache(threshold=0.5)
+    cache.store("video", unit(1, 1, 0), ["a"], "far")
+    cache.store("video", unit(1, 0.1, 0), ["a"], "close")
+    assert cache.lookup("video", unit(1, 0, 0), ["a"]) == "close"
+
+
+def test_embedding_dimension_change_misses():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("video", unit(1, 0, 0), ["a"], "answer")
+    assert cache.lookup("video", unit(1, 0), ["a"]) is None
+
+
+def test_least_recently_used_answer_is_evicted():
+    cache = SemanticAnswerCache(threshold=0.99, max_entries_per_video=2)
+    cache.store("video", unit(1, 0, 0), ["a"], "first")
+    cache.store("video", unit(0, 1, 0), ["a"], "second")
+    assert cache.lookup("video", unit(1, 0, 0), ["a"]) == "first"
+
+    cache.store("video", unit(0, 0, 1), ["a"], "third")
+    assert cache.lookup("video", unit(0, 1, 0), ["a"]) is None
+    assert cache.lookup("video", unit(1, 0, 0), ["a"]) == "first"
+    assert cache.lookup("video", unit(0, 0, 1), ["a"]) == "third"
+
+
+def test_least_recently_used_video_is_evicted():
+    cache = SemanticAnswerCache(threshold=0.9, max_videos=2)
+    for video in ("first", "second", "third"):
+        cache.store(video, unit(1, 0), ["a"], video)
+    assert cache.lookup("first", unit(1, 0), ["a"]) is None
+    assert cache.lookup("third", unit(1, 0), ["a"]) == "third"
+
+
+def test_grows_past_the_initial_capacity():
+    cache = SemanticAnswerCache(threshold=0.999, max_entries_per_video=64)
+    vectors = np.eye(32, dtype=np.float32)
+    for index, vector in enumerate(vectors):
+        cache.store("video", vector.tolist(), ["a"], str(index))
+    assert [cache.lookup("video", vector.tolist(), ["a"]) for vector in vectors] == [
+        str(index) for index in range(32)
+    ]
+
+
+def test_chunk_ids_fall_back_to_the_content_hash():
+    chunks = [Document(id="stored", page_content="x"), Document(page_content="x")]
+    ids = get_chunk_ids(chunks)
+    assert ids[0] == "stored"
+    assert ids[1] == get_chunk_ids([Document(page_content="x")])[0] != ids[0]
@@ -0,0 +1,89 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+import src.generation.artifacts as artifacts
+import src.generation.llm as llm_module
+from src.generation.artifacts import ArtifactStore, get_artifact_version, match_artifact_kind
+from src.generation.router import ProviderRouter, ResilientProvider
+
+
+@pytest.mark.parametrize(
+    "query, kind",
+    [
+        ("", "summary"),
+        (None, "summary"),
+        ("Summarize the video", "summary"),
+        ("tl;dr", "summary"),
+        ("Please give me a quick summary of this video!", "summary"),
+        ("What is this video about?", "summary"),
+        ("Chapters with timestamps", "outline"),
+        ("Can you write an outline of the video", "outline"),
+        ("key takeaways", "key_points"),
+        ("List the main points", "key_points"),
+        ("Summarize what the speaker says about transformers", None),
+        ("Who is the speaker?", None),
+        ("key points about the second half", None),
+    ],
+)
+def test_match_artifact_kind(query, kind):
+    assert match_artifact_kind(query) == kind
+
+
+def test_artifact_version_changes_with_the_model_and_prompt():
+    assert get_artifact_version("summary") == get_artifact_version("summary", llm_module.model_config["model"])
+    assert get_artifact_version("summary") != get_artifact_version("summary", "another-model")
+    assert get_artifact_version("summary") != get_artifact_version("outline")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path / "artifacts.sqlite3"))
+    monkeypatch.setattr(artifacts, "artifact_store", store)
+    monkeypatch.setattr(artifacts, "model_configs", [
+        {"model": "primary-model", "model_provider": "primary"},
+        {"model": "fallback-model", "model_provider": "fallback"},
+    ])
+    monkeypatch.setattr(artifacts, "model_config", artifacts.model_configs[0])
+    return store
+
+
+def router(answer_from_primary: bool) -> ProviderRouter:
+    def primary(_):
+        if not answer_from_primary:
+            raise ValueError("bad request")
+        return "by primary"
+
+    return ProviderRouter([
+        (ResilientProvider("primary"), RunnableLambda(primary)),
+        (ResilientProvider("fallback"), RunnableLambda(lambda _: "by fallback")),
+    ])
+
+
+def test_artifacts_are_stored_under_the_preferred_model(store, monkeypatch):
+    monkeypatch.setattr(llm_module, "llm", router(answer_from_primary=True))
+    artifacts.generate_artifacts("video", "some transcript")
+    assert store.get("video", "summary", get_artifact_version("summary")) == "by primary"
+
+
+def test_failed_over_artifacts_arent_served_as_the_preferred_model(store, monkeypatch):
+    monkeypatch.setattr(llm_module, "llm", router(answer_from_primary=False))
+    artifacts.generate_artifacts("video", "some transcript")
+    assert store.get("video", "summary", get_artifact_version("summary")) is None
+    assert store.get("video", "summary", get_artifact_version("summary", "fallback-model")) == "by fallback"
+
+
+def test_lookup_is_skipped_when_disabled(store, monkeypatch):
+    store.put("video", "summary", get_artifact_version("summary"), "The summary")
+    lookup = artifacts.runnable_lookup_artifact
+
+    monkeypatch.setattr(artifacts, "PRECOMPUTE_ARTIFACTS", False)
+    assert lookup.invoke({"query": "", "video_id": "video"})["artifact"] is None
+
+    monkeypatch.setattr(artifacts, "PRECOMPUTE_ARTIFACTS", True)
+    assert lookup.invoke({"query": "", "video_id": "video"})["artifact"] == "The summary"
+
+
+def test_reading_doesnt_create_the_database(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts.sqlite3"))
+    assert store.get("video", "summary", get_artifact_version("summary")) is None
+    assert list(tmp_path.iterdir()) == []
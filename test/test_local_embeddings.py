@@ -0,0 +1,88 @@
+import sys
+import time
+import types
+import threading
+
+import numpy as np
+import pytest
+
+from src.indexing.local_embeddings import LocalEmbeddings
+
+
+class FakeSentenceTransformer:
+    """Stands in for `sentence_transformers.SentenceTransformer`, recording its calls"""
+
+    loads: list[dict] = []
+
+    def __init__(self, model: str, device: str, **kwargs):
+        # Slow enough for concurrent first calls to overlap
+        time.sleep(0.05)
+        FakeSentenceTransformer.loads.append({"model": model, "device": device, **kwargs})
+        self.batch_sizes: list[int] = []
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy, show_progress_bar):
+        self.batch_sizes.append(batch_size)
+        vectors = np.ones((len(texts), 4), dtype=np.float64)
+        return vectors / 2 if normalize_embeddings else vectors
+
+
+@pytest.fixture
+def torch_threads(monkeypatch) -> list[int]:
+    """Installs the fake model, and collects the torch thread counts"""
+    threads: list[int] = []
+    FakeSentenceTransformer.loads = []
+    monkeypatch.setitem(
+        sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer)
+    )
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_threads=threads.append))
+    return threads
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown backend 'tensorflow'"):
+        LocalEmbeddings(backend="tensorflow")
+
+
+def test_loads_lazily_and_once(torch_threads):
+    embeddings = LocalEmbeddings(model="some/model")
+    assert FakeSentenceTransformer.loads == []
+
+    threads = [threading.Thread(target=embeddings.embed_query, args=("text",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert FakeSentenceTransformer.loads == [{"model": "some/model", "device": "cpu"}]
+
+
+def test_encode(torch_threads):
+    embeddings = LocalEmbeddings(batch_size=7)
+    vectors = embeddings.encode(["first", "second", "third"])
+    assert vectors.shape == (3, 4) and vectors.dtype == np.float32
+    assert embeddings.model.batch_sizes == [7]
+    assert embeddings.embed_documents(["first"]) == [[0.5] * 4]
+    assert embeddings.encode([]).shape == (0, 0)
+
+
+def test_torch_threads(torch_threads):
+    LocalEmbeddings(threads=3).encode(["text"])
+    assert torch_threads == [3]
+
+
+def test_onnx_threads(torch_threads):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    LocalEmbeddings(threads=3, backend="onnx", onnx_file="onnx/model_qint8_avx512.onnx").encode(["text"])
+
+    load = FakeSentenceTransformer.loads[0]
+    assert load["backend"] == "onnx"
+    assert load["model_kwargs"]["file_name"] == "onnx/model_qint8_avx512.onnx"
+    session_options = load["model_kwargs"]["session_options"]
+    assert isinstance(session_options, onnxruntime.SessionOptions)
+    assert session_options.intra_op_num_threads == 3
+    # Not through torch
+    assert torch_threads == []
+
+
+def test_onnx_without_threads(torch_threads):
+    LocalEmbeddings(threads=None, backend="onnx").encode(["text"])
+    assert FakeSentenceTransformer.loads[0] == {"model": LocalEmbeddings().model_name, "device": "cpu", "backend": "onnx"}
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+import chromadb
+import pytest
+from langchain_chroma import Chroma
+
+from langchain_core.embeddings import Embeddings
+
+from src.indexing.vectorstore import (
+    InstrumentedEmbeddings,
+    TruncatedEmbeddings,
+    add_embeddings,
+    encode_documents,
+    get_embedding_function,
+)
+
+DRIVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_driver.py")
+
+
+def ingest(tmp_path, *video_urls: str, force: bool = False, **env: str) -> dict:
+    """Runs `ingest_videos` with the fakes in a new process (the workers are spawned)"""
+    environment = {
+        **os.environ,
+        "INGEST_TEST_DIRECTORY": str(tmp_path / "db"),
+        **{f"INGEST_TEST_{name.upper()}": value for name, value in env.items()},
+    }
+    process = subprocess.run(
+        [sys.executable, DRIVER, *video_urls, *(["--force"] if force else [])],
+        cwd=tmp_path,
+        env=environment,
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    assert process.returncode == 0, process.stderr
+    # The resource tracker warns about the blocks nobody unlinked
+    assert "leaked shared_memory" not in process.stderr
+    report = json.loads(process.stdout.strip().splitlines()[-1])
+    assert report.pop("leaked") == []
+    return report
+
+
+def test_ingest_videos(tmp_path):
+    report = ingest(
+        tmp_path,
+        "https://youtu.be/aaaaaaaaaaa",
+        "bbbbbbbbbbb",
+        "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+        "ccccccccccc",
+        "not a video",
+        failing="ccccccccccc",
+    )
+    assert sorted(report["ingested"]) == ["aaaaaaaaaaa", "bbbbbbbbbbb"]
+    assert report["skipped"] == []
+    assert set(report["failed"]) == {"ccccccccccc", "not a video"}
+    assert report["n_chunks"] > 0
+
+    # Already stored videos are skipped once, however many times they are given
+    report = ingest(tmp_path, "aaaaaaaaaaa", "youtu.be/aaaaaaaaaaa", "bbbbbbbbbbb", "ddddddddddd")
+    assert report["ingested"] == ["ddddddddddd"]
+    assert sorted(report["skipped"]) == ["aaaaaaaaaaa", "bbbbbbbbbbb"]
+
+    # After a change of embedding dimension the store is reset, and the videos
+    # skipped so far are ingested again
+    report = ingest(tmp_path, "aaaaaaaaaaa", "eeeeeeeeeee", dimensions="32")
+    assert sorted(report["ingested"]) == ["aaaaaaaaaaa", "eeeeeeeeeee"]
+    assert report["skipped"] == []
+
+
+def test_ingest_videos_releases_the_pending_blocks(tmp_path):
+    videos = [letter * 11 for letter in "abcdefgh"]
+    report = ingest(tmp_path, *videos, crashing=videos[0])
+    assert report == {"error": f"Crashed after storing '{videos[0]}'"}
+
+
+class ArrayEmbeddings(Embeddings):
+    """Only computes arrays, like the local model"""
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return np.tile(np.array([0.6, 0.8, 0.0, 0.0], dtype=np.float32), (len(texts), 1))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        raise AssertionError("Converted to lists")
+
+    def embed_query(self, text: str) -> list[float]:
+        raise AssertionError("Converted to lists")
+
+
+def test_encode_documents_keeps_the_array():
+    embeddings = InstrumentedEmbeddings(TruncatedEmbeddings(ArrayEmbeddings(), 2), "local", "array")
+    vectors = encode_documents(embeddings, ["first", "second"])
+    assert isinstance(vectors, np.ndarray) and vectors.dtype == np.float32
+    assert np.allclose(vectors, [[0.6, 0.8], [0.6, 0.8]])
+
+
+def test_local_threads_reach_the_local_embeddings(monkeypatch):
+    monkeypatch.setenv("EMBEDDINGS_PROVIDER", "local")
+    get_embedding_function.cache_clear()
+    try:
+        assert get_embedding_function(local_threads=3).embeddings.threads == 3
+    finally:
+        get_embedding_function.cache_clear()
+
+
+def test_add_embeddings_batches_the_chroma_upserts(monkeypatch):
+    client = chromadb.EphemeralClient()
+    monkeypatch.setattr(client, "get_max_batch_size", lambda: 2)
+    vectorstore = Chroma(collection_name="test_add_embeddings", client=client)
+    upserts = []
+    upsert = vectorstore._collection.upsert
+
+    def recording_upsert(**kwargs):
+        upserts.append(kwargs["ids"])
+        return upsert(**kwargs)
+
+    monkeypatch.setattr(vectorstore._collection, "upsert", recording_upsert)
+
+    ids = [f"id-{i}" for i in range(5)]
+    embeddings = np.eye(5, dtype=np.float32)
+    add_embeddings(vectorstore, [f"text {i}" for i in ids], embeddings, [{"video_id": "v"}] * 5, ids)
+
+    assert upserts == [ids[0:2], ids[2:4], ids[4:5]]
+    stored = vectorstore.get(where={"video_id": "v"}, include=["embeddings"])
+    assert sorted(stored["ids"]) == ids
+    vectorstore.delete_collection()
@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from src.indexing import quantization
+from src.indexing.compact_store import CompactIndex, CompactVectorStore
+
+
+def random_unit_vectors(count: int, dimensions: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return quantization.normalize(rng.standard_normal((count, dimensions), dtype=np.float32))
+
+
+#
+# quantization
+#
+
+
+def test_truncate_renormalizes():
+    vectors = random_unit_vectors(5, 64)
+    truncated = quantization.truncate(vectors, 16)
+    assert truncated.shape == (5, 16)
+    assert np.allclose(np.linalg.norm(truncated, axis=1), 1, atol=1e-6)
+    assert np.array_equal(quantization.truncate(vectors, None), vectors)
+
+
+def test_int8_round_trip():
+    vectors = random_unit_vectors(100, 256)
+    codes, scales = quantization.quantize_int8(vectors)
+    assert codes.dtype == np.int8 and scales.shape == (100,)
+    restored = quantization.dequantize_int8(codes, scales)
+    assert np.abs(restored - vectors).max() <= scales.max() / 2 + 1e-6
+
+
+def test_binary_round_trip_keeps_the_signs():
+    vectors = random_unit_vectors(10, 100)
+    packed = quantization.quantize_binary(vectors)
+    assert packed.shape == (10, 13)
+    assert np.array_equal(quantization.unpack_binary(packed, 100), np.where(vectors > 0, 1.0, -1.0))
+
+
+def test_hamming_distances():
+    vectors = random_unit_vectors(50, 96)
+    packed = quantization.quantize_binary(vectors)
+    signs = vectors > 0
+    expected = (signs != signs[0]).sum(axis=1)
+    assert np.array_equal(quantization.hamming_distances(packed[0], packed), expected)
+
+
+def test_top_k():
+    scores = np.array([0.1, 0.9, 0.5, 0.7])
+    assert quantization.top_k(scores, 2).tolist() == [1, 3]
+    assert quantization.top_k(scores, 2, largest=False).tolist() == [0, 2]
+    assert quantization.top_k(scores, 10).tolist() == [1, 3, 2, 0]
+    assert quantization.top_k(scores, 0).tolist() == []
+
+
+#
+# CompactIndex
+#
+
+
+def build_index(mode: str, vectors: np.ndarray) -> CompactIndex:
+    index = CompactIndex(mode, vectors.shape[1])
+    count = len(vectors)
+    index.add([f"id-{i}" for i in range(count)], vectors, [f"text {i}" for i in range(count)], [{}] * count)
+    return index
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_compact_index_finds_the_nearest_vector(mode):
+    vectors = random_unit_vectors(500, 128)
+    index = build_index(mode, vectors)
+    noise = random_unit_vectors(20, 128, seed=1)
+    for position in range(20):
+        query = quantization.normalize(vectors[position] + 0.3 * noise[position])
+        assert index.search(query, k=4)[0][0] == position
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_compact_index_scores_are_close_to_the_exact_ones(mode):
+    vectors = random_unit_vectors(200, 128)
+    index = build_index(mode, vectors)
+    query = random_unit_vectors(1, 128, seed=1)[0]
+    for position, score in index.search(query, k=4):
+        assert score == pytest.approx(float(vectors[position] @ query), abs=0.01)
+
+
+def test_binary_rescoring_uses_the_int8_copy():
+    # With every vector as a candidate, the results are the ones of the int8 index
+    vectors = random_unit_vectors(300, 64)
+    query = random_unit_vectors(1, 64, seed=1)[0]
+    binary = build_index("binary", vectors).search(query, k=4, rerank_candidates=300)
+    assert binary == pytest.approx(build_index("int8", vectors).search(query, k=4))
+
+
+def test_binary_index_sizes():
+    index = build_index("binary", random_unit_vectors(10, 64))
+    # 1 bit per dimension and the int8 scales in memory, 1 byte per dimension on disk
+    assert index.nbytes == 10 * (64 // 8 + 4)
+    assert index.rescore_nbytes == 10 * 64
+
+
+def test_compact_index_save_and_load(tmp_path):
+    vectors = random_unit_vectors(100, 64)
+    index = build_index("binary", vectors)
+    path = str(tmp_path / "video")
+    index.save(path)
+
+    loaded = CompactIndex.load(path)
+    assert isinstance(loaded.rescore_codes, np.memmap)
+    assert loaded.ids == index.ids and loaded.texts == index.texts
+    query = vectors[7]
+    assert loaded.search(query, k=3) == index.search(query, k=3)
+
+    # Appending to a loaded (memory mapped) index, and saving over it
+    loaded.add(["new"], random_unit_vectors(1, 64, seed=2), ["new"], [{}])
+    loaded.save(path)
+    assert len(CompactIndex.load(path)) == 101
+
+
+def test_binary_index_without_rescoring_copy(tmp_path):
+    vectors = random_unit_vectors(100, 64)
+    path = str(tmp_path / "video")
+    build_index("binary", vectors).save(path)
+    os.remove(path + ".rescore.npy")
+
+    loaded = CompactIndex.load(path)
+    assert loaded.rescore_codes is None
+    assert loaded.search(vectors[3], k=1)[0][0] == 3
+
+
+def test_compact_index_dimension_mismatch():
+    index = build_index("int8", random_unit_vectors(10, 64))
+    with pytest.raises(ValueError, match="Collection expecting embedding with dimension of 64, got 32"):
+        index.search(random_unit_vectors(1, 32)[0], k=1)
+
+
+#
+# CompactVectorStore
+#
+
+
+class HashEmbeddings(Embeddings):
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return random_unit_vectors(1, 32, seed=sum(map(ord, text)))[0].tolist()
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_compact_vector_store(tmp_path, mode):
+    store = CompactVectorStore("test", str(tmp_path), HashEmbeddings(), mode=mode)
+    store.add_texts(["alpha", "beta"], [{"video_id": "first"}, {"video_id": "first"}])
+    store.add_texts(["gamma"], [{"video_id": "second"}])
+    assert store.video_ids() == ["first", "second"]
+
+    results = store.similarity_search("beta", k=1, filter={"video_id": "first"})
+    assert [doc.page_content for doc in results] == ["beta"]
+    assert store.similarity_search("beta", k=4, filter={"video_id": "second"})[0].page_content == "gamma"
+
+    # Persisted, and loaded back by another store
+    reloaded = CompactVectorStore("test", str(tmp_path), HashEmbeddings(), mode=mode)
+    assert reloaded.similarity_search("alpha", k=1, filter={"video_id": "first"})[0].page_content == "alpha"
+
+    store.reset_collection()
+    assert store.video_ids() == []
+    assert store.similarity_search("alpha", k=1, filter={"video_id": "first"}) == []
@@ -0,0 +1,100 @@
+import sys
+import types
+
+import pytest
+from langchain.schema import Document
+
+import src.retrieval.reranker as reranker
+import src.retrieval.retriever as retriever
+from src.retrieval.reranker import get_cross_encoder, rerank, runnable_rerank_docs
+
+
+class FakeCrossEncoder:
+    """Scores a chunk by the number given in its text"""
+
+    def __init__(self):
+        self.batch_sizes: list[int] = []
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        self.batch_sizes.append(batch_size)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+@pytest.fixture
+def cross_encoder(monkeypatch) -> FakeCrossEncoder:
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(reranker, "_cross_encoder", model)
+    monkeypatch.setattr(reranker, "_cross_encoder_error", None)
+    return model
+
+
+def chunks(*scores: float) -> list[Document]:
+    return [Document(page_content=f"chunk {index} {score}") for index, score in enumerate(scores)]
+
+
+def contents(documents: list[Document]) -> list[str]:
+    return [document.page_content for document in documents]
+
+
+def test_rerank_orders_by_score(cross_encoder):
+    candidates = chunks(0.1, 0.9, 0.5, 0.7)
+    assert contents(rerank("query", candidates, top_n=3)) == ["chunk 1 0.9", "chunk 3 0.7", "chunk 2 0.5"]
+    assert cross_encoder.batch_sizes == [reranker.RERANK_BATCH_SIZE]
+
+
+def test_rerank_keeps_the_vector_order_on_ties(cross_encoder):
+    candidates = chunks(0.5, 0.9, 0.5, 0.5)
+    assert contents(rerank("query", candidates, top_n=4)) == [
+        "chunk 1 0.9", "chunk 0 0.5", "chunk 2 0.5", "chunk 3 0.5",
+    ]
+
+
+def test_rerank_without_the_model(monkeypatch):
+    loads = []
+
+    def broken_cross_encoder(*args, **kwargs):
+        loads.append(args)
+        raise OSError("no such model")
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=broken_cross_encoder))
+    monkeypatch.setattr(reranker, "_cross_encoder", None)
+    monkeypatch.setattr(reranker, "_cross_encoder_error", None)
+
+    candidates = chunks(0.1, 0.9, 0.5)
+    assert rerank("query", candidates, top_n=2) == candidates[:2]
+    # Not loaded again on every request
+    assert get_cross_encoder() is None
+    assert len(loads) == 1
+
+
+def test_runnable_only_reranks_when_enabled(cross_encoder, monkeypatch):
+    candidates = chunks(0.1, 0.9)
+    monkeypatch.setattr(reranker, "RERANK_ENABLED", False)
+    assert runnable_rerank_docs.invoke({"chunks": candidates, "query": "query"})["chunks"] == candidates
+
+    monkeypatch.setattr(reranker, "RERANK_ENABLED", True)
+    reranked = runnable_rerank_docs.invoke({"chunks": candidates, "query": "query"})["chunks"]
+    assert contents(reranked) == ["chunk 1 0.9", "chunk 0 0.1"]
+
+
+class FakeVectorStore:
+    """Records the searches of the retriever"""
+
+    def __init__(self):
+        self.searches: list[dict] = []
+
+    def similarity_search_by_vector(self, embedding, **kwargs):
+        self.searches.append(kwargs)
+        return []
+
+
+@pytest.mark.parametrize("enabled, k", [(False, 4), (True, reranker.RERANK_FETCH_K)])
+def test_retriever_over_fetches_when_reranking(monkeypatch, enabled, k):
+    store = FakeVectorStore()
+    monkeypatch.setattr(retriever, "get_vector_store", lambda: store)
+    monkeypatch.setattr(retriever, "RERANK_ENABLED", enabled)
+
+    retriever.runnable_retrieve_docs.invoke(
+        {"query": "query", "video_url": "", "video_id": "dQw4w9WgXcQ", "query_embedding": [1.0, 0.0]}
+    )
+    assert store.searches == [{"k": k, "filter": {"video_id": "dQw4w9WgXcQ"}}]
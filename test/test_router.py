@@ -0,0 +1,280 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+import src.generation.router as router
+from langchain_core.messages import AIMessage
+
+from src.generation.router import (
+    CircuitBreaker,
+    ProviderRouter,
+    ProviderUnavailableError,
+    ResilientProvider,
+    TokenBucket,
+    is_rate_limit_error,
+    is_retryable_error,
+)
+
+
+class FakeClock:
+    """Stands in for the `time` module of the router, sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(router, "time", clock)
+    return clock
+
+
+#
+# TokenBucket
+#
+
+
+def test_token_bucket_burst_then_waits(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2.0)
+    assert bucket.acquire() and bucket.acquire()
+    assert clock.now == 1000.0
+    assert bucket.acquire()
+    assert clock.now == pytest.approx(1001.0)
+
+
+def test_token_bucket_charges_requests_above_capacity_in_full(clock):
+    limit = 60_000
+    bucket = TokenBucket.per_minute(limit)
+    admitted = []
+    for _ in range(3):
+        assert bucket.acquire(50_000)
+        admitted.append(clock.now - 1000.0)
+
+    # Never more than a minute of quota ahead of the refill
+    for index, elapsed in enumerate(admitted):
+        assert 50_000 * (index + 1) <= limit + elapsed * limit / 60
+    assert admitted[-1] >= 90
+
+
+def test_token_bucket_charge(clock):
+    bucket = TokenBucket(rate=1.0, capacity=10.0)
+    bucket.charge(15)
+    assert not bucket.acquire(max_wait=4.0)
+    # Refunds never go above the capacity
+    bucket.charge(-100)
+    assert bucket.acquire(10, max_wait=0.0)
+    assert not bucket.acquire(max_wait=0.5)
+
+
+def test_token_bucket_max_wait_doesnt_charge(clock):
+    bucket = TokenBucket(rate=1.0, capacity=1.0)
+    assert bucket.acquire()
+    assert not bucket.acquire(max_wait=0.5)
+    clock.sleep(1.0)
+    assert bucket.acquire(max_wait=0.0)
+
+
+#
+# CircuitBreaker
+#
+
+
+def test_circuit_breaker_states(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10)
+    assert breaker.state == "closed" and breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow_request()
+
+    # A single trial once half open
+    clock.sleep(10)
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    # A failed trial opens the circuit again
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.sleep(10)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow_request()
+
+
+#
+# Errors
+#
+
+
+class StatusError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimitError(Exception):
+    pass
+
+
+@pytest.mark.parametrize(
+    "error, rate_limited, retryable",
+    [
+        (Exception("429 Too Many Requests"), True, True),
+        (Exception("Rate limit reached for requests"), True, True),
+        (Exception("RESOURCE_EXHAUSTED: You exceeded your current quota"), True, True),
+        (RateLimitError("slow down"), True, True),
+        (StatusError("quota", 400), False, False),
+        (StatusError("server error", 503), False, True),
+        (TimeoutError(), False, True),
+        (ValueError("prompt has 14290 tokens, max is 8192"), False, False),
+        (ValueError("400 Bad Request: input too long"), False, False),
+    ],
+)
+def test_error_classification(error, rate_limited, retryable):
+    assert is_rate_limit_error(error) == rate_limited
+    assert is_retryable_error(error) == retryable
+
+
+#
+# ResilientProvider
+#
+
+
+def test_throttled_trial_doesnt_lock_the_circuit(clock, monkeypatch):
+    monkeypatch.setattr(router, "ROUTER_MAX_WAIT_SECONDS", 1.0)
+    bucket = TokenBucket(rate=1.0, capacity=1.0)
+    provider = ResilientProvider(
+        "x",
+        requests_bucket=bucket,
+        breaker=CircuitBreaker(failure_threshold=1, reset_seconds=5),
+        max_retries=0,
+    )
+
+    def fail():
+        raise Exception("503 Service Unavailable")
+
+    with pytest.raises(Exception, match="503"):
+        provider.call(fail)
+    assert provider.breaker.state == "open"
+
+    # Half open, but the quota is exhausted for too long: the trial isn't used
+    clock.sleep(5)
+    bucket.pause(10)
+    with pytest.raises(ProviderUnavailableError, match="Quota"):
+        provider.call(lambda: "ok")
+
+    # Once the quota is back, the trial goes through and closes the circuit
+    clock.sleep(20)
+    assert provider.call(lambda: "ok") == "ok"
+    assert provider.breaker.state == "closed"
+
+
+def test_client_errors_dont_open_the_circuit(clock):
+    provider = ResilientProvider("x", breaker=CircuitBreaker(failure_threshold=2))
+
+    def too_long():
+        raise ValueError("400 Bad Request: input too long")
+
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            provider.call(too_long)
+    assert provider.breaker.state == "closed"
+    assert provider.call(lambda: "ok") == "ok"
+
+    # Nor keep the half open trial
+    provider.breaker.record_failure()
+    provider.breaker.record_failure()
+    clock.sleep(provider.breaker.reset_seconds)
+    with pytest.raises(ValueError):
+        provider.call(too_long)
+    assert provider.call(lambda: "ok") == "ok"
+    assert provider.breaker.state == "closed"
+
+
+def test_retries_rate_limits(clock):
+    calls = []
+
+    def flaky():
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise Exception("429 Too Many Requests")
+        return "ok"
+
+    provider = ResilientProvider("x", max_retries=3)
+    assert provider.call(flaky) == "ok"
+    assert len(calls) == 3
+
+
+def test_doesnt_retry_other_errors(clock):
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        ResilientProvider("x", max_retries=3).call(broken)
+    assert len(calls) == 1
+
+
+#
+# ProviderRouter
+#
+
+
+def test_router_fails_over_to_the_next_provider(clock):
+    def unavailable(_):
+        raise Exception("503 Service Unavailable")
+
+    first = ResilientProvider("first", max_retries=1)
+    second = ResilientProvider("second")
+    llm = ProviderRouter([
+        (first, RunnableLambda(unavailable)),
+        (second, RunnableLambda(lambda prompt: f"second: {prompt}")),
+    ])
+    assert llm.invoke("hello") == "second: hello"
+
+
+def test_router_charges_the_real_usage(clock):
+    tokens = TokenBucket(rate=1.0, capacity=1000.0)
+    message = AIMessage(
+        "answer", usage_metadata={"input_tokens": 10, "output_tokens": 790, "total_tokens": 800}
+    )
+    llm = ProviderRouter([(ResilientProvider("x", tokens_bucket=tokens), RunnableLambda(lambda _: message))])
+    assert llm.invoke("x" * 40) is message
+    # 10 estimated up front, then the 790 left
+    assert tokens.acquire(200, max_wait=0.0)
+    assert not tokens.acquire(1, max_wait=0.5)
+
+
+def test_router_skips_open_circuits(clock):
+    calls = []
+    first = ResilientProvider("first", breaker=CircuitBreaker(failure_threshold=1))
+    first.breaker.record_failure()
+    llm = ProviderRouter([
+        (first, RunnableLambda(lambda prompt: calls.append(prompt))),
+        (ResilientProvider("second"), RunnableLambda(lambda prompt: "second")),
+    ])
+    assert llm.invoke("hello") == "second"
+    assert calls == []
+
+
+def test_router_raises_the_last_error(clock):
+    def broken(_):
+        raise ValueError("bad request")
+
+    llm = ProviderRouter([
+        (ResilientProvider("first"), RunnableLambda(broken)),
+        (ResilientProvider("second"), RunnableLambda(broken)),
+    ])
+    with pytest.raises(ValueError):
+        llm.invoke("hello")
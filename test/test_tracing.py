@@ -0,0 +1,181 @@
+import os
+import json
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+import src.instrumentation.tracing as tracing
+from src.instrumentation.tracing import (
+    UsageCallbackHandler,
+    add_span_listener,
+    current_trace_id,
+    increment_counter,
+    remove_span_listener,
+    render_prometheus,
+    reset_metrics,
+    span,
+    stage_latencies,
+)
+
+
+@pytest.fixture(autouse=True)
+def metrics():
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+@pytest.fixture
+def spans():
+    records = []
+    add_span_listener(records.append)
+    yield records
+    remove_span_listener(records.append)
+
+
+class FakeTime:
+    """Stands in for the `time` module of the tracing, each span lasting `wall_seconds`"""
+
+    def __init__(self, wall_seconds: float):
+        self.wall_seconds = wall_seconds
+        self.now = 0.0
+
+    def time(self) -> float:
+        return 0.0
+
+    def perf_counter(self) -> float:
+        self.now += self.wall_seconds
+        return self.now
+
+    def thread_time(self) -> float:
+        return 0.0
+
+
+#
+# Spans
+#
+
+
+def test_spans_nest_within_a_trace(spans):
+    with span("request") as attributes:
+        outer_trace = current_trace_id()
+        with span("retrieve", k=4):
+            assert current_trace_id() == outer_trace
+        attributes["n_chunks"] = 4
+    assert current_trace_id() is None
+
+    with span("request"):
+        pass
+
+    inner, outer, other = spans
+    assert inner["name"] == "retrieve" and inner["attributes"] == {"k": 4}
+    assert inner["trace_id"] == outer["trace_id"] == outer_trace
+    assert inner["parent_id"] == outer["span_id"] and outer["parent_id"] is None
+    assert outer["attributes"] == {"n_chunks": 4}
+    assert other["trace_id"] != outer_trace
+
+
+def test_failed_span(spans):
+    with pytest.raises(ValueError):
+        with span("generate"):
+            raise ValueError("boom")
+    assert spans[0]["status"] == "error"
+    assert spans[0]["attributes"]["error"] == "ValueError: boom"
+    assert 'yt_stage_errors_total{stage="generate"} 1' in render_prometheus()
+
+
+def test_disabled_tracing_keeps_the_stage_metrics(spans, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", False)
+    with span("retrieve"):
+        assert current_trace_id() is None
+    assert spans == []
+    assert stage_latencies()["retrieve"][0] == 1
+
+
+#
+# Metrics
+#
+
+
+def test_latency_histogram_is_cumulative(monkeypatch):
+    for wall_seconds in (0.003, 0.03, 0.3, 100):
+        monkeypatch.setattr(tracing, "time", FakeTime(wall_seconds))
+        with span("generate"):
+            pass
+
+    page = render_prometheus()
+    assert 'yt_stage_duration_seconds_bucket{stage="generate",le="0.005"} 1' in page
+    assert 'yt_stage_duration_seconds_bucket{stage="generate",le="0.05"} 2' in page
+    assert 'yt_stage_duration_seconds_bucket{stage="generate",le="0.5"} 3' in page
+    assert 'yt_stage_duration_seconds_bucket{stage="generate",le="60"} 3' in page
+    assert 'yt_stage_duration_seconds_bucket{stage="generate",le="+Inf"} 4' in page
+    assert 'yt_stage_duration_seconds_count{stage="generate"} 4' in page
+    assert 'yt_stage_duration_seconds_sum{stage="generate"} 100.333000' in page
+    assert stage_latencies()["generate"] == (4, pytest.approx(100.333))
+
+
+def test_label_values_are_escaped():
+    increment_counter("yt_cache_requests_total", cache='say "hi"\\\nbye', result="hit")
+    assert 'yt_cache_requests_total{cache="say \\"hi\\"\\\\\\nbye",result="hit"} 1' in render_prometheus()
+
+
+def test_usage_callback_handler():
+    handler = UsageCallbackHandler()
+
+    # Usage reported on the message
+    run_id = uuid.uuid4()
+    handler.on_chat_model_start({}, [], run_id=run_id, metadata={"ls_provider": "openai", "ls_model_name": "gpt-4.1"})
+    message = AIMessage("answer", usage_metadata={"input_tokens": 1000, "output_tokens": 500, "total_tokens": 1500})
+    handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=run_id)
+
+    # Or in the provider specific output
+    run_id = uuid.uuid4()
+    handler.on_chat_model_start({}, [], run_id=run_id, metadata={"ls_provider": "openai", "ls_model_name": "gpt-4.1"})
+    handler.on_llm_end(
+        LLMResult(
+            generations=[[ChatGeneration(message=AIMessage("answer"))]],
+            llm_output={"token_usage": {"prompt_tokens": 10, "completion_tokens": 5}},
+        ),
+        run_id=run_id,
+    )
+
+    page = render_prometheus()
+    labels = 'kind="llm",model="gpt-4.1",provider="openai"'
+    assert f"yt_model_calls_total{{{labels}}} 2" in page
+    assert f'yt_tokens_total{{direction="input",{labels}}} 1010' in page
+    assert f'yt_tokens_total{{direction="output",{labels}}} 505' in page
+    # 1010 input tokens at $2 and 505 output tokens at $8 per million
+    assert f"yt_cost_usd_total{{{labels}}} 0.00606" in page
+
+
+def test_usage_is_attached_to_the_open_span(spans):
+    with span("generate"):
+        tracing.record_usage("llm", "openai", "gpt-4.1", 100, 50)
+    assert spans[0]["attributes"] == {
+        "input_tokens": 100, "output_tokens": 50, "cost_usd": pytest.approx(0.0006), "model": "gpt-4.1",
+    }
+
+
+#
+# Log
+#
+
+
+def test_log_rotation(tmp_path, monkeypatch):
+    path = str(tmp_path / "logs" / "traces.jsonl")
+    monkeypatch.setattr(tracing, "TRACE_LOG_FILE", path)
+    monkeypatch.setattr(tracing, "TRACE_LOG_MAX_BYTES", 1)
+    monkeypatch.setattr(tracing, "TRACE_LOG_BACKUPS", 2)
+
+    # One span per write, each write rotates the log
+    for index in range(4):
+        with span("stage", index=index):
+            pass
+        tracing.flush()
+
+    assert sorted(os.listdir(tmp_path / "logs")) == ["traces.jsonl.1", "traces.jsonl.2"]
+    for suffix, index in ((".1", 3), (".2", 2)):
+        with open(path + suffix, encoding="utf-8") as file:
+            assert [json.loads(line)["attributes"]["index"] for line in file] == [index]
@@ -0,0 +1,89 @@
+import os
+import sys
+import timeit
+
+# Make `src` importable when running `python test/test_video_id.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.indexing.video_id import parse_video_id, parse_video_ids
+
+# URL => expected video ID (None if the URL must be rejected)
+TEST_CORPUS = {
+    # watch?v=
+    'http://www.youtube.com/watch?v=5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    'https://www.youtube.com/watch?v=2USUfv7klr8': '2USUfv7klr8',
+    'https://youtube.com/watch?v=dQw4w9WgXcQ&t=42s': 'dQw4w9WgXcQ',
+    'https://www.youtube.com/watch?feature=player_embedded&v=dQw4w9WgXcQ': 'dQw4w9WgXcQ',
+    'https://www.youtube.com/watch?feature=share&amp;v=dQw4w9WgXcQ': 'dQw4w9WgXcQ',
+    'https://m.youtube.com/watch?v=4g-fPNjizrw': '4g-fPNjizrw',
+    'https://music.youtube.com/watch?v=4g-fPNjizrw&list=RDAMVM4g-fPNjizrw': '4g-fPNjizrw',
+    'HTTPS://WWW.YOUTUBE.COM/watch?v=4g-fPNjizrw': '4g-fPNjizrw',
+    'www.youtube.com/watch?v=4g-fPNjizrw': '4g-fPNjizrw',
+    # youtu.be
+    'http://youtu.be/5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    'https://youtu.be/5Y6HSHwhVlY?si=abcdefgh&t=10': '5Y6HSHwhVlY',
+    'youtu.be/_-aB0cD1eF2': '_-aB0cD1eF2',
+    # embed / v / e / live / shorts
+    'http://www.youtube.com/embed/5Y6HSHwhVlY?rel=0" frameborder="0"': '5Y6HSHwhVlY',
+    'https://www.youtube-nocookie.com/embed/5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    'https://www.youtube-nocookie.com/v/5Y6HSHwhVlY?version=3&amp;hl=en_US': '5Y6HSHwhVlY',
+    'https://www.youtube.com/v/5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    'https://www.youtube.com/e/5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    'https://www.youtube.com/live/5Y6HSHwhVlY?feature=share': '5Y6HSHwhVlY',
+    'https://www.youtube.com/shorts/5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    # Bare video IDs
+    '5Y6HSHwhVlY': '5Y6HSHwhVlY',
+    '  5Y6HSHwhVlY  ': '5Y6HSHwhVlY',
+    # Invalid
+    'http://www.youtube.com/': None,
+    'http://example.com/watch?v=5Y6HSHwhVlY': None,
+    'https://notyoutube.com/watch?v=5Y6HSHwhVlY': None,
+    'https://www.youtube.com/watch?v=5Y6HSHwhVl': None,
+    'https://www.youtube.com/watch?v=5Y6HSHwhVlYX': None,
+    'https://www.youtube.com/channel/UC_x5XG1OV2P6uZZ5FSM9Ttw': None,
+    '5Y6HSHwhVl': None,
+    '': None,
+}
+
+
+def test_parse_video_id():
+    for url, expected in TEST_CORPUS.items():
+        assert parse_video_id(url) == expected, f"{url!r} => {parse_video_id(url)!r}, expected {expected!r}"
+
+
+def test_parse_video_ids():
+    urls = list(TEST_CORPUS) + [None]
+    assert parse_video_ids(urls) == list(TEST_CORPUS.values()) + [None]
+
+
+def test_bare_ids_only_when_allowed():
+    assert parse_video_id('hello_world') == 'hello_world'
+    assert parse_video_id('hello_world', allow_bare_id=False) is None
+    assert parse_video_ids(['hello_world', 'https://youtu.be/5Y6HSHwhVlY'], allow_bare_id=False) == [
+        None, '5Y6HSHwhVlY',
+    ]
+
+
+def test_user_input_must_be_a_url():
+    from src.indexing.document_loader import YouTubeTranscriptsLoader
+
+    assert YouTubeTranscriptsLoader.is_valid_youtube_url('hello_world') == (False, None)
+    assert YouTubeTranscriptsLoader.is_valid_youtube_url('https://youtu.be/5Y6HSHwhVlY') == (True, '5Y6HSHwhVlY')
+    # The pipeline and the bulk ingestion still resolve bare IDs
+    assert YouTubeTranscriptsLoader.get_video_id('5Y6HSHwhVlY') == '5Y6HSHwhVlY'
+
+
+if __name__ == '__main__':
+    failures = 0
+    for url, expected in TEST_CORPUS.items():
+        video_id = parse_video_id(url)
+        status = "ok" if video_id == expected else f"FAILED (expected {expected})"
+        failures += video_id != expected
+        print(f"{url} => {video_id} {status}")
+
+    # Rough throughput of the batch API (not memoized), on distinct URLs
+    urls = [f"https://www.youtube.com/watch?v={index:011d}&t=1s" for index in range(100_000)]
+    seconds = timeit.timeit(lambda: parse_video_ids(urls), number=1)
+    print(f"\nParsed {len(urls):,} URLs in {seconds:.3f}s ({len(urls) / seconds:,.0f} URLs/s)")
+
+    sys.exit(1 if failures else 0)